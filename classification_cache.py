@@ -0,0 +1,129 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+
+# Kept out of temp/, whose age-based cleanup would delete the database (and its WAL files) under a live connection
+CLASSIFICATION_CACHE_PATH = os.getenv('CLASSIFICATION_CACHE_PATH', os.path.join('cache', 'classification_cache.sqlite3'))
+CLASSIFICATION_CACHE_MAX_ENTRIES = int(os.getenv('CLASSIFICATION_CACHE_MAX_ENTRIES', 200000))
+
+
+def classification_cache_key(img_b64, classifier, unfurnished_mode, prompt_version, image_detail=None):
+    """Fingerprint of exactly what the classifier is shown plus everything that shapes its answer.
+
+    ``classifier`` names the prompt and response format (e.g. ``'single'`` or ``'batch'``), so a label
+    from one classifier is never served to the other.
+    """
+    digest = hashlib.sha256(img_b64.encode('ascii')).hexdigest()
+    return f"{digest}:{classifier}:{int(bool(unfurnished_mode))}:{prompt_version}:{image_detail or ''}"
+
+
+class ClassificationCache:
+    """SQLite-backed LRU of room labels, bounded by number of entries."""
+
+    def __init__(self, db_path=CLASSIFICATION_CACHE_PATH, max_entries=CLASSIFICATION_CACHE_MAX_ENTRIES):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._connection = None
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0
+
+    def _connect(self):
+        if self._connection is None:
+            directory = os.path.dirname(self.db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self.db_path, timeout=10, check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS labels ('
+                'key TEXT PRIMARY KEY, label TEXT NOT NULL, last_used REAL NOT NULL)'
+            )
+            connection.execute('CREATE INDEX IF NOT EXISTS labels_last_used ON labels (last_used)')
+            self._connection = connection
+        return self._connection
+
+    def get_many(self, keys):
+        """Return ``{key: label}`` for the keys that are cached, refreshing their recency."""
+        keys = [key for key in dict.fromkeys(keys) if key]
+        if not keys or not self.enabled:
+            return {}
+        found = {}
+        try:
+            with self._lock:
+                connection = self._connect()
+                for start in range(0, len(keys), 500):
+                    chunk = keys[start:start + 500]
+                    placeholders = ','.join('?' * len(chunk))
+                    rows = connection.execute(
+                        f'SELECT key, label FROM labels WHERE key IN ({placeholders})', chunk
+                    ).fetchall()
+                    found.update(rows)
+                if found:
+                    now = time.time()
+                    connection.executemany('UPDATE labels SET last_used = ? WHERE key = ?',
+                                           [(now, key) for key in found])
+                    connection.commit()
+        except sqlite3.Error as e:
+            print(f"Classification cache read failed: {e}")
+            return {}
+        return found
+
+    def get(self, key):
+        return self.get_many([key]).get(key)
+
+    def put_many(self, entries):
+        """Store ``{key: label}``; unknown labels (None) are never cached so they get retried."""
+        rows = [(key, label, time.time()) for key, label in entries.items() if key and label]
+        if not rows or not self.enabled:
+            return False
+        try:
+            with self._lock:
+                connection = self._connect()
+                connection.executemany(
+                    'INSERT OR REPLACE INTO labels (key, label, last_used) VALUES (?, ?, ?)', rows
+                )
+                connection.commit()
+        except sqlite3.Error as e:
+            print(f"Classification cache write failed: {e}")
+            return False
+        self.evict()
+        return True
+
+    def put(self, key, label):
+        return self.put_many({key: label})
+
+    def evict(self):
+        """Drop least recently used labels until the cache fits its entry budget."""
+        try:
+            with self._lock:
+                connection = self._connect()
+                count = connection.execute('SELECT COUNT(*) FROM labels').fetchone()[0]
+                if count <= self.max_entries:
+                    return
+                connection.execute(
+                    'DELETE FROM labels WHERE key IN '
+                    '(SELECT key FROM labels ORDER BY last_used LIMIT ?)', (count - self.max_entries,)
+                )
+                connection.commit()
+        except sqlite3.Error as e:
+            print(f"Classification cache eviction failed: {e}")
+
+    def status(self):
+        try:
+            with self._lock:
+                entries = self._connect().execute('SELECT COUNT(*) FROM labels').fetchone()[0]
+        except sqlite3.Error:
+            entries = None
+        return {
+            'db_path': self.db_path,
+            'max_entries': self.max_entries,
+            'entries': entries
+        }
+
+
+classification_cache = ClassificationCache()
@@ -0,0 +1,128 @@
+import os
+import json
+import shutil
+import hashlib
+import threading
+import uuid
+
+CLIP_CACHE_DIR = os.getenv('CLIP_CACHE_DIR', os.path.join('temp', 'clip_cache'))
+CLIP_CACHE_MAX_BYTES = int(os.getenv('CLIP_CACHE_MAX_BYTES', 4 * 1024 * 1024 * 1024))
+
+
+def get_source_identity(video_path):
+    """Identify a source file by location, size and modification time without hashing its contents."""
+    stat = os.stat(video_path)
+    return {
+        'path': os.path.realpath(video_path),
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns
+    }
+
+
+def clip_cache_key(video_path, **params):
+    """Content address of a rendered clip: the source identity plus everything that shapes the output."""
+    try:
+        source = get_source_identity(video_path)
+    except OSError:
+        return None
+    payload = json.dumps({'source': source, 'params': params}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class ClipCache:
+    """On-disk LRU cache of rendered clips, bounded by total size in bytes."""
+
+    def __init__(self, cache_dir=CLIP_CACHE_DIR, max_bytes=CLIP_CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def _entry_path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f'{key}.mp4')
+
+    def contains(self, key):
+        return bool(key) and self.enabled and os.path.exists(self._entry_path(key))
+
+    def fetch(self, key, output):
+        """Copy the cached clip for ``key`` to ``output``; returns False on a miss."""
+        if not key or not self.enabled:
+            return False
+        entry = self._entry_path(key)
+        try:
+            # Copy rather than link: ffmpeg -y truncates outputs in place and would corrupt the entry
+            shutil.copyfile(entry, output)
+            os.utime(entry)
+            return True
+        except FileNotFoundError:
+            return False
+        except OSError as e:
+            print(f"Clip cache read failed for {key[:12]}: {e}")
+            return False
+
+    def store(self, key, clip_path):
+        if not key or not self.enabled:
+            return False
+        if not os.path.exists(clip_path) or os.path.getsize(clip_path) < 1000:
+            return False
+        entry = self._entry_path(key)
+        temp_entry = f'{entry}.{uuid.uuid4().hex[:8]}.tmp'
+        try:
+            os.makedirs(os.path.dirname(entry), exist_ok=True)
+            shutil.copyfile(clip_path, temp_entry)
+            os.replace(temp_entry, entry)
+        except OSError as e:
+            print(f"Clip cache write failed for {key[:12]}: {e}")
+            if os.path.exists(temp_entry):
+                try:
+                    os.remove(temp_entry)
+                except OSError:
+                    pass
+            return False
+        self.evict()
+        return True
+
+    def _entries(self):
+        entries = []
+        if not os.path.isdir(self.cache_dir):
+            return entries
+        for root, _, files in os.walk(self.cache_dir):
+            for filename in files:
+                if not filename.endswith('.mp4'):
+                    continue
+                path = os.path.join(root, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def evict(self):
+        """Drop least recently used clips until the cache fits its byte budget."""
+        with self._lock:
+            entries = sorted(self._entries())
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                    total -= size
+                except OSError:
+                    pass
+
+    def status(self):
+        entries = self._entries()
+        return {
+            'cache_dir': self.cache_dir,
+            'max_bytes': self.max_bytes,
+            'entries': len(entries),
+            'bytes': sum(size for _, size, _ in entries)
+        }
+
+
+clip_cache = ClipCache()
@@ -0,0 +1,236 @@
+import os
+import time
+import threading
+import subprocess
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+
+DEFAULT_STALL_TIMEOUT = int(os.getenv('FFMPEG_STALL_TIMEOUT', 90))
+
+_progress_sink = contextvars.ContextVar('ffmpeg_progress_sink', default=None)
+
+
+_cancel_event = contextvars.ContextVar('ffmpeg_cancel_event', default=None)
+
+
+class FFmpegCancelled(Exception):
+    pass
+
+
+@contextmanager
+def cancellation(event):
+    """Kill every ffmpeg run in this context (including pool workers started with its copy) once ``event`` is set."""
+    token = _cancel_event.set(event)
+    try:
+        yield
+    finally:
+        _cancel_event.reset(token)
+
+
+@contextmanager
+def progress_reporter(callback):
+    """Send progress snapshots of every ffmpeg run in this context to ``callback``."""
+    token = _progress_sink.set(callback)
+    try:
+        yield
+    finally:
+        _progress_sink.reset(token)
+
+
+class ProgressAggregator:
+    """One overall progress figure for a stage that runs several ffmpeg tasks concurrently.
+
+    Each task is weighted by its expected output duration. Snapshots from the task's runs move only
+    its own share, and a task counts as done once it returns, even if it never ran ffmpeg (a cache hit).
+    The current job's ``fps``/``speed`` ride along as secondary fields.
+    """
+
+    def __init__(self, stage, weights, sink=None):
+        self.stage = stage
+        self.sink = sink or _progress_sink.get()
+        self._weights = [weight if weight and weight > 0 else 1.0 for weight in weights]
+        self._fractions = [0.0] * len(self._weights)
+        self._lock = threading.Lock()
+        self._started_at = time.time()
+
+    def track(self, index, fn):
+        """Wrap ``fn`` so the ffmpeg runs it makes report as task ``index`` of this stage."""
+        if self.sink is None:
+            return fn
+
+        def run(*args, **kwargs):
+            token = _progress_sink.set(lambda snapshot: self._update(index, snapshot))
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                _progress_sink.reset(token)
+                self._update(index, None)
+        return run
+
+    def _update(self, index, snapshot):
+        with self._lock:
+            if snapshot is None:
+                fraction = 1.0
+            elif snapshot.get('percent') is not None:
+                fraction = snapshot['percent'] / 100.0
+            else:
+                fraction = self._fractions[index]
+            # A task may make several runs (retries, fallbacks); its share never moves backwards
+            self._fractions[index] = max(self._fractions[index], min(1.0, fraction))
+
+            total = sum(self._weights)
+            overall = sum(weight * done for weight, done in zip(self._weights, self._fractions)) / total
+            elapsed = time.time() - self._started_at
+            progress = {
+                'stage': self.stage,
+                'out_time': None,
+                'fps': (snapshot or {}).get('fps'),
+                'speed': (snapshot or {}).get('speed'),
+                'elapsed': round(elapsed, 1),
+                'percent': round(overall * 100, 1),
+                'eta_seconds': round(elapsed / overall * (1.0 - overall), 1) if overall > 0 else None
+            }
+            try:
+                self.sink(progress)
+            except Exception as e:
+                print(f"Progress callback error: {e}")
+
+
+def _parse_out_time(values):
+    for key in ('out_time_us', 'out_time_ms'):
+        raw = values.get(key)
+        if raw and raw.lstrip('-').isdigit():
+            # ffmpeg reports out_time_ms in microseconds as well
+            return max(0.0, int(raw) / 1_000_000)
+    raw = values.get('out_time')
+    if raw and ':' in raw:
+        try:
+            hours, minutes, seconds = raw.split(':')
+            return max(0.0, int(hours) * 3600 + int(minutes) * 60 + float(seconds))
+        except ValueError:
+            return None
+    return None
+
+
+def _parse_float(value):
+    if not value:
+        return None
+    try:
+        return float(value.rstrip('x'))
+    except ValueError:
+        return None
+
+
+def build_progress_snapshot(values, expected_duration, started_at, stage=None):
+    out_time = _parse_out_time(values) or 0.0
+    elapsed = time.time() - started_at
+    snapshot = {
+        'stage': stage,
+        'out_time': round(out_time, 2),
+        'fps': _parse_float(values.get('fps')),
+        'speed': _parse_float(values.get('speed')),
+        'elapsed': round(elapsed, 1),
+        'percent': None,
+        'eta_seconds': None
+    }
+    if expected_duration and expected_duration > 0:
+        fraction = min(1.0, out_time / expected_duration)
+        snapshot['percent'] = round(fraction * 100, 1)
+        if values.get('progress') == 'end':
+            snapshot['percent'] = 100.0
+            snapshot['eta_seconds'] = 0
+        elif out_time > 0:
+            snapshot['eta_seconds'] = round(elapsed / out_time * (expected_duration - out_time), 1)
+    return snapshot
+
+
+def run_ffmpeg(cmd, expected_duration=None, stall_timeout=None, stage=None, on_progress=None, cancel_event=None):
+    """Run ffmpeg with ``-progress pipe:1``, publishing progress and killing it only when it stalls.
+
+    Returns a ``subprocess.CompletedProcess`` like ``subprocess.run(..., capture_output=True, text=True)``
+    and raises ``subprocess.TimeoutExpired`` when no progress is made for ``stall_timeout`` seconds.
+    Setting ``cancel_event`` kills the process and raises ``FFmpegCancelled``.
+    """
+    cancel_events = [event for event in (cancel_event, _cancel_event.get()) if event is not None]
+    if any(event.is_set() for event in cancel_events):
+        raise FFmpegCancelled(stage or 'ffmpeg')
+
+    stall_timeout = stall_timeout or DEFAULT_STALL_TIMEOUT
+    on_progress = on_progress or _progress_sink.get()
+    cmd = [str(part) for part in cmd]
+    cmd = cmd[:1] + ['-progress', 'pipe:1', '-nostats'] + cmd[1:]
+
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    started_at = time.time()
+    state = {'last_progress_at': started_at, 'last_marker': None}
+    state_lock = threading.Lock()
+    stderr_tail = deque(maxlen=200)
+
+    def read_stderr():
+        for line in process.stderr:
+            stderr_tail.append(line)
+
+    def read_progress():
+        values = {}
+        for line in process.stdout:
+            key, _, value = line.strip().partition('=')
+            if not key:
+                continue
+            values[key] = value
+            if key != 'progress':
+                continue
+
+            marker = (values.get('out_time_us') or values.get('out_time'), values.get('frame'))
+            with state_lock:
+                if marker != state['last_marker']:
+                    state['last_marker'] = marker
+                    state['last_progress_at'] = time.time()
+
+            if on_progress:
+                try:
+                    on_progress(build_progress_snapshot(values, expected_duration, started_at, stage))
+                except Exception as e:
+                    print(f"Progress callback error: {e}")
+            values = {}
+
+    readers = [
+        threading.Thread(target=read_stderr, daemon=True),
+        threading.Thread(target=read_progress, daemon=True)
+    ]
+    for reader in readers:
+        reader.start()
+
+    stalled = False
+    cancelled = False
+    while process.poll() is None:
+        # Wake as soon as ffmpeg exits so short jobs (single-frame grabs) don't pay a full poll interval
+        try:
+            process.wait(timeout=0.5)
+            break
+        except subprocess.TimeoutExpired:
+            pass
+        if any(event.is_set() for event in cancel_events):
+            print(f"FFmpeg cancelled ({stage or 'ffmpeg'})")
+            cancelled = True
+            process.kill()
+            process.wait()
+            break
+        with state_lock:
+            idle = time.time() - state['last_progress_at']
+        if idle > stall_timeout:
+            print(f"FFmpeg stalled: no progress for {idle:.0f}s ({stage or 'ffmpeg'})")
+            stalled = True
+            process.kill()
+            process.wait()
+            break
+
+    for reader in readers:
+        reader.join(timeout=5)
+
+    if cancelled:
+        raise FFmpegCancelled(stage or 'ffmpeg')
+    if stalled:
+        raise subprocess.TimeoutExpired(cmd, stall_timeout, stderr=''.join(stderr_tail))
+
+    return subprocess.CompletedProcess(cmd, process.returncode, stdout='', stderr=''.join(stderr_tail))
@@ -0,0 +1,171 @@
+import os
+import math
+import itertools
+import threading
+import contextvars
+from contextlib import contextmanager
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_EXPORT = 10
+PRIORITY_BACKGROUND = 20
+
+_job_context = contextvars.ContextVar('ffmpeg_job_context', default=None)
+_current_lease = contextvars.ContextVar('ffmpeg_current_lease', default=None)
+
+
+def get_cpu_quota():
+    """Number of CPUs this process may actually use, honouring cgroup quotas and affinity."""
+    try:
+        available = len(os.sched_getaffinity(0))
+    except AttributeError:
+        available = os.cpu_count() or 2
+
+    quota = None
+    try:
+        with open('/sys/fs/cgroup/cpu.max', 'r') as f:
+            max_value, period = f.read().split()[:2]
+            if max_value != 'max':
+                quota = int(max_value) / int(period)
+    except (OSError, ValueError):
+        try:
+            with open('/sys/fs/cgroup/cpu/cpu.cfs_quota_us', 'r') as f:
+                quota_us = int(f.read().strip())
+            with open('/sys/fs/cgroup/cpu/cpu.cfs_period_us', 'r') as f:
+                period_us = int(f.read().strip())
+            if quota_us > 0 and period_us > 0:
+                quota = quota_us / period_us
+        except (OSError, ValueError):
+            pass
+
+    if quota:
+        available = min(available, math.ceil(quota))
+    return max(1, available)
+
+
+class SlotLease:
+
+    def __init__(self, scheduler, project_id, priority, threads):
+        self.scheduler = scheduler
+        self.project_id = project_id
+        self.priority = priority
+        self.threads = str(threads)
+
+
+class FFmpegScheduler:
+    """Bounded pool of ffmpeg slots handed out by priority, then to the project with the fewest running jobs."""
+
+    def __init__(self, max_slots=None, cpu_count=None):
+        self.cpu_count = cpu_count or get_cpu_quota()
+        self.max_slots = max_slots or int(os.getenv('FFMPEG_MAX_JOBS', 0)) or max(1, self.cpu_count // 2)
+        self.threads_per_slot = max(1, self.cpu_count // self.max_slots)
+        self._condition = threading.Condition()
+        self._waiting = []
+        self._active = 0
+        self._active_by_project = {}
+        self._sequence = itertools.count()
+
+    def _next_ticket(self):
+        return min(
+            self._waiting,
+            key=lambda ticket: (ticket[0], self._active_by_project.get(ticket[2], 0), ticket[1])
+        )
+
+    def acquire(self, priority=PRIORITY_EXPORT, project_id=None):
+        ticket = (priority, next(self._sequence), project_id)
+        with self._condition:
+            self._waiting.append(ticket)
+            while not (self._active < self.max_slots and self._next_ticket() is ticket):
+                self._condition.wait()
+            self._waiting.remove(ticket)
+            self._active += 1
+            self._active_by_project[project_id] = self._active_by_project.get(project_id, 0) + 1
+            self._condition.notify_all()
+        return SlotLease(self, project_id, priority, self.threads_per_slot)
+
+    def release(self, lease):
+        with self._condition:
+            self._active = max(0, self._active - 1)
+            remaining = self._active_by_project.get(lease.project_id, 0) - 1
+            if remaining > 0:
+                self._active_by_project[lease.project_id] = remaining
+            else:
+                self._active_by_project.pop(lease.project_id, None)
+            self._condition.notify_all()
+
+    @contextmanager
+    def lease(self, priority=None, project_id=None):
+        # Nested leases in the same thread reuse the outer slot instead of deadlocking the pool
+        current = _current_lease.get()
+        if current is not None:
+            yield current
+            return
+
+        context = _job_context.get() or {}
+        if priority is None:
+            priority = context.get('priority', PRIORITY_EXPORT)
+        if project_id is None:
+            project_id = context.get('project_id')
+
+        lease = self.acquire(priority, project_id)
+        token = _current_lease.set(lease)
+        try:
+            yield lease
+        finally:
+            _current_lease.reset(token)
+            self.release(lease)
+
+    def status(self):
+        with self._condition:
+            return {
+                'max_slots': self.max_slots,
+                'threads_per_slot': self.threads_per_slot,
+                'active': self._active,
+                'waiting': len(self._waiting),
+                'active_by_project': dict(self._active_by_project)
+            }
+
+
+scheduler = FFmpegScheduler()
+
+
+@contextmanager
+def job_context(project_id=None, priority=PRIORITY_EXPORT):
+    """Tag every ffmpeg lease taken in this thread with a project and a default priority."""
+    token = _job_context.set({'project_id': project_id, 'priority': priority})
+    try:
+        yield
+    finally:
+        _job_context.reset(token)
+
+
+def lease(priority=None, project_id=None):
+    return scheduler.lease(priority, project_id)
+
+
+def acquire(priority=None, project_id=None):
+    """Take a slot without a ``with`` block, defaulting to the job context like ``lease``.
+
+    For generators that must hand the slot back while suspended at a ``yield``; pair with ``release``.
+    """
+    current = _current_lease.get()
+    if current is not None:
+        return current
+    context = _job_context.get() or {}
+    if priority is None:
+        priority = context.get('priority', PRIORITY_EXPORT)
+    if project_id is None:
+        project_id = context.get('project_id')
+    return scheduler.acquire(priority, project_id)
+
+
+def release(slot):
+    # A slot borrowed from an enclosing lease belongs to that lease
+    if slot is not _current_lease.get():
+        scheduler.release(slot)
+
+
+def submit_in_context(executor, fn, *args, **kwargs):
+    """Submit to a thread pool while keeping the caller's job context for the worker's leases."""
+    context = contextvars.copy_context()
+    context.run(_current_lease.set, None)
+    return executor.submit(context.run, fn, *args, **kwargs)
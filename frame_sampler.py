@@ -0,0 +1,362 @@
+import os
+import tempfile
+import threading
+import subprocess
+from collections import deque
+import cv2
+import numpy as np
+from video_utils import probe_video_geometry, load_keyframe_index
+from ffmpeg_scheduler import acquire as ffmpeg_acquire, release as ffmpeg_release, PRIORITY_BACKGROUND
+from ffmpeg_runner import run_ffmpeg
+
+# Longest side of sampled frames; the classifier never needs more than this
+SAMPLE_MAX_SIDE = 512
+
+# Shot detection decodes tiny frames at a low rate and compares their colour histograms
+SHOT_SCAN_SIDE = 96
+SHOT_SCAN_FPS = 4.0
+SHOT_CHANGE_THRESHOLD = 0.35
+SHOT_MIN_DURATION = 1.0
+SHOT_MAX_DURATION = 15.0
+# The scan only compares colour histograms, so the decoder may skip deblocking and non-reference
+# frames; when keyframes are at least this dense it decodes keyframes alone
+SHOT_SCAN_KEYFRAME_GAP = 1.0
+
+
+def get_sample_size(video_path, video_info=None, max_side=SAMPLE_MAX_SIDE):
+    """Display size of the video scaled so its longest side is at most ``max_side`` (even dimensions)."""
+    geometry = probe_video_geometry(video_path)
+    if geometry:
+        width, height = geometry['width'] * geometry.get('sar', 1.0), geometry['height']
+        if geometry.get('rotation') in (90, 270):
+            width, height = height, width
+    elif video_info:
+        width, height = video_info.get('width', 1920), video_info.get('height', 1080)
+    else:
+        return None
+
+    scale = min(1.0, max_side / max(width, height))
+    return max(2, int(width * scale) // 2 * 2), max(2, int(height * scale) // 2 * 2)
+
+
+def perceptual_hash(frame, hash_size=8):
+    """64-bit difference hash: brightness gradients of a 9x8 grey thumbnail, as a boolean array."""
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+    thumbnail = cv2.resize(gray, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    return (thumbnail[:, 1:] > thumbnail[:, :-1]).ravel()
+
+
+def hash_distance(first, second):
+    return int(np.count_nonzero(first != second))
+
+
+def color_signature(frame, hue_bins=16, sat_bins=4, val_bins=4):
+    """Normalised joint HSV histogram of a BGR frame, computed with a single bincount."""
+    hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV).reshape(-1, 3).astype(np.int32)
+    index = (hsv[:, 0] * hue_bins // 180) * sat_bins * val_bins \
+        + (hsv[:, 1] * sat_bins // 256) * val_bins \
+        + hsv[:, 2] * val_bins // 256
+    histogram = np.bincount(index, minlength=hue_bins * sat_bins * val_bins).astype(np.float32)
+    return histogram / max(1.0, histogram.sum())
+
+
+def signature_distance(first, second):
+    """Total variation distance between two colour signatures, from 0 (identical) to 1."""
+    return float(np.abs(first - second).sum() / 2.0)
+
+
+def _iter_frames_ffmpeg(video_path, interval, size, start_time=0.0, decode_args=()):
+    """Decode in ffmpeg and pipe out only the sampled frames, already scaled to ``size``, as raw BGR.
+
+    Decoding starts with an input seek to ``start_time``; timestamps stay relative to the video.
+    ``decode_args`` are extra input (decoder) options such as ``-skip_frame``.
+
+    The scheduler slot is held only while reading from ffmpeg, never while suspended at ``yield``:
+    a consumer blocked on the classifier stalls ffmpeg on its full pipe, so the slot would sit idle
+    and lock out interactive jobs.
+    """
+    width, height = size
+    frame_bytes = width * height * 3
+
+    slot = ffmpeg_acquire(priority=PRIORITY_BACKGROUND)
+    cmd = ['ffmpeg', '-v', 'error', '-threads', slot.threads]
+    if start_time > 0:
+        cmd += ['-ss', f'{start_time:.3f}']
+    cmd += list(decode_args) + [
+        '-i', str(video_path),
+        '-an', '-sn',
+        '-vf', f'fps=1/{interval},scale={width}:{height}:flags=area',
+        '-f', 'rawvideo', '-pix_fmt', 'bgr24',
+        'pipe:1'
+    ]
+    try:
+        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    except OSError:
+        ffmpeg_release(slot)
+        raise
+    stderr_tail = deque(maxlen=50)
+
+    def read_stderr():
+        for line in process.stderr:
+            stderr_tail.append(line.decode('utf-8', 'replace'))
+
+    reader = threading.Thread(target=read_stderr, daemon=True)
+    reader.start()
+
+    index = 0
+    try:
+        while True:
+            if slot is None:
+                slot = ffmpeg_acquire(priority=PRIORITY_BACKGROUND)
+            buffer = process.stdout.read(frame_bytes)
+            if len(buffer) < frame_bytes:
+                break
+            frame = np.frombuffer(buffer, dtype=np.uint8).reshape((height, width, 3))
+            ffmpeg_release(slot)
+            slot = None
+            yield start_time + index * interval, frame
+            index += 1
+    finally:
+        if slot is not None:
+            ffmpeg_release(slot)
+        if process.poll() is None:
+            process.kill()
+        process.wait()
+        reader.join(timeout=5)
+
+    if process.returncode not in (0, None) and index == 0:
+        raise RuntimeError(f"ffmpeg frame sampling failed: {''.join(stderr_tail)[-300:]}")
+
+
+def _iter_frames_opencv(video_path, interval, size, fps, start_time=0.0):
+    """Fallback sampler: grab() every frame but only retrieve() and convert the sampled ones."""
+    cap = cv2.VideoCapture(str(video_path))
+    if not cap.isOpened():
+        raise RuntimeError(f"Failed to open video for frame sampling: {video_path}")
+
+    sample_every = max(1, int(round(fps * interval)))
+    frame_count = 0
+    if start_time > 0:
+        frame_count = int(round(start_time * fps))
+        cap.set(cv2.CAP_PROP_POS_FRAMES, frame_count)
+    try:
+        while cap.grab():
+            if frame_count % sample_every == 0:
+                ret, frame = cap.retrieve()
+                if not ret:
+                    break
+                if size and (frame.shape[1], frame.shape[0]) != size:
+                    frame = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+                yield frame_count / fps, frame
+            frame_count += 1
+    finally:
+        cap.release()
+
+
+def frame_quality(frame):
+    """Higher is better: Laplacian variance (focus / motion blur) damped by clipped shadows and highlights."""
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+    sharpness = float(cv2.Laplacian(gray, cv2.CV_32F).var())
+    clipped = float(np.count_nonzero((gray < 16) | (gray > 239))) / gray.size
+    return sharpness * (1.0 - clipped)
+
+
+def _iter_timed_frames(video_path, step, size, fps, start_time=0.0, decode_args=()):
+    produced = 0
+    if size:
+        try:
+            for timestamp, frame in _iter_frames_ffmpeg(video_path, step, size, start_time, decode_args):
+                produced += 1
+                yield timestamp, frame
+        except (RuntimeError, OSError) as e:
+            print(f"ffmpeg sampler unavailable, falling back to OpenCV: {e}")
+        if produced:
+            return
+
+    yield from _iter_frames_opencv(video_path, step, size, fps, start_time)
+
+
+def sample_frames(video_path, interval, video_info=None, max_side=SAMPLE_MAX_SIDE, candidates=1, start_time=0.0,
+                  decode_args=()):
+    """Yield ``{'time', 'frame', 'frame_number'}`` for one frame every ``interval`` seconds.
+
+    Frames come out at classifier resolution. ffmpeg does the decode, frame selection and
+    scaling; OpenCV is used only when ffmpeg cannot read the file. With ``candidates > 1`` each
+    interval is decoded at that many evenly spaced frames and the one with the best
+    :func:`frame_quality` is kept, so motion-blurred frames are skipped when a sharper one is near.
+    A ``start_time`` seeks to the interval containing it instead of decoding from the beginning;
+    the frames picked from there on are the ones a full pass would pick. ``decode_args`` go to the
+    ffmpeg decoder and are ignored by the OpenCV fallback.
+    """
+    fps = (video_info or {}).get('fps') or 30
+    size = get_sample_size(video_path, video_info, max_side)
+    candidates = max(1, int(candidates))
+    # Snap to the sampling grid so a seek lands on the same frames as a full pass
+    start_time = int(max(0.0, start_time) / interval + 1e-6) * interval
+
+    if candidates == 1:
+        for timestamp, frame in _iter_timed_frames(video_path, interval, size, fps, start_time, decode_args):
+            yield {'time': timestamp, 'frame': frame, 'frame_number': int(round(timestamp * fps))}
+        return
+
+    best = None
+    for timestamp, frame in _iter_timed_frames(video_path, interval / candidates, size, fps, start_time, decode_args):
+        window = int(timestamp / interval + 1e-6)
+        if best is not None and window != best[0]:
+            yield {'time': best[2], 'frame': best[3], 'frame_number': int(round(best[2] * fps))}
+            best = None
+        score = frame_quality(frame)
+        if best is None or score > best[1]:
+            best = (window, score, timestamp, frame)
+    if best is not None:
+        yield {'time': best[2], 'frame': best[3], 'frame_number': int(round(best[2] * fps))}
+
+
+def _grab_frame_ffmpeg(video_path, timestamp, size, threads):
+    """Input-seek to ``timestamp`` and decode a single frame at ``size``; None if nothing came out.
+
+    Runs through :func:`run_ffmpeg` for stall detection and cancellation, which needs stdout for
+    progress, so the frame goes through a scratch file instead of a pipe.
+    """
+    width, height = size
+    frame_bytes = width * height * 3
+    fd, raw_path = tempfile.mkstemp(suffix='.bgr')
+    os.close(fd)
+    cmd = [
+        'ffmpeg', '-y', '-v', 'error',
+        '-threads', threads,
+        '-ss', f'{timestamp:.3f}',
+        '-i', str(video_path),
+        '-an', '-sn',
+        '-frames:v', '1',
+        '-vf', f'scale={width}:{height}:flags=area',
+        '-f', 'rawvideo', '-pix_fmt', 'bgr24',
+        raw_path
+    ]
+    try:
+        # A single-frame grab is not export progress; keep it out of the job's progress sink
+        result = run_ffmpeg(cmd, stage='frame grab', on_progress=lambda snapshot: None)
+        if result.returncode != 0:
+            return None
+        with open(raw_path, 'rb') as f:
+            buffer = f.read(frame_bytes)
+    finally:
+        try:
+            os.remove(raw_path)
+        except OSError:
+            pass
+    if len(buffer) < frame_bytes:
+        return None
+    return np.frombuffer(buffer, dtype=np.uint8).reshape((height, width, 3))
+
+
+def grab_frames_at(video_path, timestamps, video_info=None, max_side=SAMPLE_MAX_SIDE, priority=PRIORITY_BACKGROUND):
+    """Yield ``{'time', 'frame', 'frame_number'}`` for each requested timestamp, in ascending order.
+
+    Each frame is reached by seeking, so sparse timestamps cost a few decodes each rather than
+    a pass over the whole video. Timestamps ffmpeg cannot produce are retried with OpenCV.
+    Seeks take ffmpeg slots at ``priority``; pass None to use the calling job's priority.
+    """
+    fps = (video_info or {}).get('fps') or 30
+    size = get_sample_size(video_path, video_info, max_side)
+    cap = None
+
+    try:
+        for timestamp in sorted(set(timestamps)):
+            frame = None
+            if size:
+                # One short lease per seek so the slot is free while the consumer works on the frame
+                slot = ffmpeg_acquire(priority=priority)
+                try:
+                    frame = _grab_frame_ffmpeg(video_path, timestamp, size, slot.threads)
+                except (OSError, subprocess.TimeoutExpired) as e:
+                    print(f"ffmpeg frame grab failed at {timestamp:.2f}s: {e}")
+                finally:
+                    ffmpeg_release(slot)
+
+            if frame is None:
+                if cap is None:
+                    cap = cv2.VideoCapture(str(video_path))
+                cap.set(cv2.CAP_PROP_POS_MSEC, timestamp * 1000)
+                ret, frame = cap.read()
+                if not ret or frame is None:
+                    continue
+                if size and (frame.shape[1], frame.shape[0]) != size:
+                    frame = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+
+            yield {'time': timestamp, 'frame': frame, 'frame_number': int(round(timestamp * fps))}
+    finally:
+        if cap is not None:
+            cap.release()
+
+
+def shot_scan_decode_args(video_path):
+    """Decoder options for the shot scan: keyframes only when they are dense enough, else skip what histograms don't need."""
+    keyframes = load_keyframe_index(video_path)
+    if keyframes and len(keyframes) > 1 and \
+            max(later - earlier for earlier, later in zip(keyframes, keyframes[1:])) <= SHOT_SCAN_KEYFRAME_GAP + 1e-3:
+        return ['-skip_frame', 'nokey']
+    return ['-skip_loop_filter', 'all', '-skip_frame', 'nonref']
+
+
+def detect_shots(video_path, video_info=None, scan_fps=SHOT_SCAN_FPS, threshold=SHOT_CHANGE_THRESHOLD,
+                 min_duration=SHOT_MIN_DURATION, max_duration=SHOT_MAX_DURATION, stop_event=None):
+    """Split the video into visual shots as a list of ``(start, end)`` seconds.
+
+    A shot ends when a frame's colour signature drifts more than ``threshold`` from the frame that
+    opened it, so both hard cuts and gradual pans into another room register. Shots are at least
+    ``min_duration`` and at most ``max_duration`` long. Setting ``stop_event`` abandons the scan
+    and returns no shots.
+    """
+    duration = (video_info or {}).get('duration')
+    boundaries = [0.0]
+    anchor = None
+    last_time = 0.0
+    samples = sample_frames(video_path, 1.0 / scan_fps, video_info, max_side=SHOT_SCAN_SIDE,
+                            decode_args=shot_scan_decode_args(video_path))
+    try:
+        for sample in samples:
+            if stop_event is not None and stop_event.is_set():
+                print("Shot detection stopped")
+                return []
+            signature = color_signature(sample['frame'])
+            last_time = sample['time']
+            shot_length = last_time - boundaries[-1]
+            if anchor is None:
+                anchor = signature
+            elif shot_length >= max_duration or \
+                    (shot_length >= min_duration and signature_distance(signature, anchor) > threshold):
+                boundaries.append(last_time)
+                anchor = signature
+    finally:
+        samples.close()
+
+    end = duration or last_time + 1.0 / scan_fps
+    boundaries.append(end)
+    return [(start, stop) for start, stop in zip(boundaries, boundaries[1:]) if stop > start]
+
+
+def sample_shot_frames(video_path, video_info=None, max_side=SAMPLE_MAX_SIDE, start_time=0.0, **shot_options):
+    """Yield one or two representative frames per shot instead of one every fixed interval.
+
+    Frames look like :func:`sample_frames` output plus ``shot_start``/``shot_end``. Shots long
+    enough to hold two minimum-length shots get frames at one and three quarters of the way in,
+    so even a single-shot room gets two votes; shorter shots get their midpoint. Shots are always
+    detected over the whole video, but representatives before ``start_time`` are not grabbed.
+    """
+    shots = detect_shots(video_path, video_info, **shot_options)
+    min_duration = shot_options.get('min_duration', SHOT_MIN_DURATION)
+    print(f"Detected {len(shots)} shots in {video_path}")
+
+    representatives = {}
+    for start, end in shots:
+        length = end - start
+        offsets = (0.25, 0.75) if length >= 2 * min_duration else (0.5,)
+        for offset in offsets:
+            timestamp = round(start + length * offset, 3)
+            if timestamp >= start_time:
+                representatives[timestamp] = (start, end)
+
+    for sample in grab_frames_at(video_path, representatives, video_info, max_side):
+        sample['shot_start'], sample['shot_end'] = representatives[sample['time']]
+        yield sample
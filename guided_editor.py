@@ -1,27 +1,36 @@
 
 from pathlib import Path
 from video_utils import get_video_info, get_quality_settings, capture_frame
-from scene_detection import detect_scene_label, classify_image_scene
+from scene_detection import detect_scene_label, detect_scene_labels, classify_image_scene
 from video_processor import extract_clip_simple, extract_clip_hq, combine_clips, combine_clips_hq
-from tour_creator import create_tour_simple, create_speedup_tour_simple, create_tour
+from tour_creator import create_tour_simple, create_speedup_tour_simple, create_tour, create_draft_tour
 from post_processor import add_music_overlay
 from video_filters import apply_video_filters
 
 class GuidedVideoEditor:
     
-    def __init__(self, video_path, project_temp_dir=None):
+    def __init__(self, video_path, project_temp_dir=None, label_timeline=None):
         self.video_path = Path(video_path)
         self.video_info = get_video_info(self.video_path)
         self.user_segments = []
         self.project_temp_dir = project_temp_dir
+        self.label_timeline = label_timeline
     
+    def _needs_label(self, label):
+        return not label or str(label).lower() in {"", "auto", "none"}
+
+    def _lookup_label(self, start_time, end_time):
+        return self.label_timeline.lookup(start_time, end_time) if self.label_timeline else None
+
     def add_segment(self, start_time, end_time, label=None, speed_factor=1.0):
         if start_time < 0 or end_time > self.video_info['duration']:
             print(f" Invalid time range")
             return False
 
-        if not label or str(label).lower() in {"", "auto", "none"}:
-            detected_label = detect_scene_label(self.video_path, start_time, end_time)
+        if self._needs_label(label):
+            detected_label = self._lookup_label(start_time, end_time)
+            if not detected_label:
+                detected_label = detect_scene_label(self.video_path, start_time, end_time)
             if detected_label:
                 label = detected_label
             else:
@@ -39,6 +48,40 @@ class GuidedVideoEditor:
         print(f"Added: {start_time:.1f}s - {end_time:.1f}s ({label}) [speed: {speed_factor}x]")
         return True
 
+    def add_segments(self, segments, speed_factor=1.0, unfurnished_mode=False):
+        """Add ``(start_time, end_time, label)`` segments, labelling all unlabeled ones in one batched pass."""
+        added = []
+        unlabeled = []
+        for start_time, end_time, label in segments:
+            if start_time < 0 or end_time > self.video_info['duration']:
+                print(f" Invalid time range: {start_time:.1f}s - {end_time:.1f}s")
+                continue
+
+            segment = {
+                'start_time': start_time,
+                'end_time': end_time,
+                'duration': end_time - start_time,
+                'label': label,
+                'speed_factor': speed_factor
+            }
+            if self._needs_label(label):
+                segment['label'] = self._lookup_label(start_time, end_time)
+                if not segment['label']:
+                    unlabeled.append(segment)
+            added.append(segment)
+
+        if unlabeled:
+            print(f"Auto-labelling {len(unlabeled)} segments in one batch...")
+            labels = detect_scene_labels(self.video_path, [(segment['start_time'], segment['end_time']) for segment in unlabeled],
+                                         unfurnished_mode=unfurnished_mode, video_info=self.video_info)
+            for segment, detected_label in zip(unlabeled, labels):
+                segment['label'] = detected_label or 'unlabeled'
+
+        for segment in added:
+            self.user_segments.append(segment)
+            print(f"Added: {segment['start_time']:.1f}s - {segment['end_time']:.1f}s ({segment['label']}) [speed: {speed_factor}x]")
+        return len(added)
+
     def create_tour_simple(self, output_path="guided_tour.mp4"):
         return create_tour_simple(self.user_segments, self.video_path, self.video_info, output_path, self.project_temp_dir)
 
@@ -48,6 +91,9 @@ class GuidedVideoEditor:
     def create_tour(self, output_path="guided_tour.mp4", api_key=None, quality='professional'):
         return create_tour(self.user_segments, self.video_path, self.video_info, output_path, api_key, quality, self.project_temp_dir)
 
+    def create_draft_tour(self, output_path, export_mode='segments', speed_factor=3.0, extra_filters=None):
+        return create_draft_tour(self.user_segments, self.video_path, self.video_info, output_path, export_mode, speed_factor, extra_filters)
+
     def get_quality_settings(self, quality='professional'):
         return get_quality_settings(quality)
 
@@ -6,7 +6,7 @@ import shutil
 import base64, uuid
 from datetime import datetime
 from guided_editor import GuidedVideoEditor
-from video_filters import get_available_presets
+from video_filters import get_available_presets, get_filter_chain
 import subprocess
 from dld_api import fetch_listing_details
 from dotenv import load_dotenv 
@@ -16,6 +16,10 @@ import time
 import threading
 from post_processor import add_agent_property_overlays
 from scene_detection import detect_room_transitions_realtime, detect_scene_label, get_room_display_name
+from label_timeline import build_label_timeline
+from video_utils import build_keyframe_index, get_keyframe_index_path
+from ffmpeg_scheduler import job_context, lease as ffmpeg_lease, PRIORITY_INTERACTIVE, PRIORITY_EXPORT
+from ffmpeg_runner import run_ffmpeg, progress_reporter, cancellation
 
 load_dotenv() 
 
@@ -94,6 +98,7 @@ for proc_id, proc_data in legacy_processing_results.items():
 
 
 app.processing_results = {}
+app.processing_cancel_events = {}
 app.detection_sessions = {}
 
 def _cleanup_temp_files(force=False, age_threshold=None):
@@ -118,6 +123,7 @@ def _cleanup_temp_files(force=False, age_threshold=None):
             {'prefix': 'agency_logo_', 'suffix': '.png', 'default_threshold': 7200},
             {'prefix': 'qr_', 'suffix': '.png', 'default_threshold': 7200},
             {'prefix': 'processing_', 'suffix': '.mp4', 'default_threshold': 7200},
+            {'prefix': 'draft_', 'suffix': '.mp4', 'default_threshold': 7200},
             {'prefix': 'filtered_', 'suffix': '.mp4', 'default_threshold': 7200},
             {'prefix': 'temp_frame_', 'suffix': '.jpg', 'default_threshold': 7200},
         ]
@@ -168,6 +174,11 @@ def _cleanup_temp_files(force=False, age_threshold=None):
 def cleanup_temp_files():
     _cleanup_temp_files(force=False)
 
+def get_label_timeline(project_id, video_path, unfurnished_mode=None):
+    if project_id and project_id in app.projects:
+        return build_label_timeline(app.projects[project_id].get('detection_sessions'), unfurnished_mode)
+    return build_label_timeline(app.detection_sessions, unfurnished_mode, video_path=video_path)
+
 def safe_send_file(filename):
     if not os.path.isfile(filename):
         return "File not found", 404
@@ -217,7 +228,8 @@ def upload_video():
         ]
         
         try:
-            result = subprocess.run(remux_cmd, capture_output=True, text=True, timeout=120)  
+            with ffmpeg_lease(priority=PRIORITY_INTERACTIVE, project_id=project_id):
+                result = run_ffmpeg(remux_cmd, stage='remux')
             if result.returncode == 0:
                 print(f"Successfully remuxed to {new_video_path}")
                 video_path = new_video_path  
@@ -239,6 +251,8 @@ def upload_video():
     if not editor.video_info:
         return jsonify({'error': 'Invalid video'}), 400
     
+    keyframes = build_keyframe_index(video_path)
+    
     app.projects[project_id] = {
         'project_id': project_id,
         'video_id': video_id,
@@ -247,7 +261,8 @@ def upload_video():
         'detection_sessions': {},
         'created_at': timestamp,
         'status': 'active',
-        'video_info': editor.video_info
+        'video_info': editor.video_info,
+        'keyframe_index': get_keyframe_index_path(video_path) if keyframes else None
     }
     
     
@@ -538,6 +553,7 @@ def start_video_processing():
     filter_settings = data.get('filter_settings', {'preset': 'none'})
     existing_processing_id = data.get('processing_id') 
     project_id = data.get('project_id')
+    draft_preview = data.get('draft_preview', False)
     
     if not segments:
         return jsonify({'error': 'No segments provided'}), 400
@@ -566,10 +582,19 @@ def start_video_processing():
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     processing_id = existing_processing_id or f"proc_{project_id or 'legacy'}_{timestamp}_{uuid.uuid4().hex[:6]}"
     
+    # A new cut for the same processing_id supersedes the render still running for the old one
+    previous_cancel_event = app.processing_cancel_events.get(processing_id)
+    if previous_cancel_event is not None:
+        print(f"Cancelling superseded render for {processing_id}")
+        previous_cancel_event.set()
+    cancel_event = threading.Event()
+    app.processing_cancel_events[processing_id] = cancel_event
+    
     
     temp_dir = os.path.join('temp', project_id or 'legacy')
     os.makedirs(temp_dir, exist_ok=True)
     temp_filename = os.path.join(temp_dir, f'processing_{timestamp}.mp4')
+    draft_filename = os.path.join(temp_dir, f'draft_{timestamp}.mp4')
     print(f"Created project-specific temp directory: {temp_dir}")
     
     
@@ -582,7 +607,8 @@ def start_video_processing():
         'quality': quality,
         'segments_count': len(segments),
         'created_at': timestamp,
-        'status': 'in_progress'
+        'status': 'in_progress',
+        'draft_status': 'pending' if draft_preview else None
     }
     
     if project_id and project_id in app.projects:
@@ -595,12 +621,48 @@ def start_video_processing():
     
     save_projects()
     
+    def report_progress(snapshot):
+        processing_result['progress'] = snapshot['percent']
+        processing_result['eta_seconds'] = snapshot['eta_seconds']
+        processing_result['stage'] = snapshot['stage']
+        processing_result['fps'] = snapshot['fps']
+        processing_result['speed'] = snapshot['speed']
+    
     def process_video():
+        try:
+            with job_context(project_id=project_id or processing_id, priority=PRIORITY_EXPORT):
+                with progress_reporter(report_progress), cancellation(cancel_event):
+                    _process_video()
+        finally:
+            if app.processing_cancel_events.get(processing_id) is cancel_event:
+                app.processing_cancel_events.pop(processing_id, None)
+    
+    def render_draft(editor):
+        processing_result['draft_status'] = 'rendering'
+        extra_filters = get_filter_chain(filter_settings) if filter_settings else []
+        with job_context(project_id=project_id or processing_id, priority=PRIORITY_INTERACTIVE):
+            draft_success = editor.create_draft_tour(draft_filename, export_mode, speed_factor, extra_filters)
+            if draft_success and music_path and os.path.exists(music_path):
+                if not editor.add_music_overlay(draft_filename, music_path, music_volume):
+                    print("Failed to add music to draft - keeping silent draft")
+        
+        if draft_success:
+            processing_result['draft_status'] = 'ready'
+            processing_result['draft_file'] = draft_filename
+            print(f"Draft ready for {processing_id}: {draft_filename}")
+        else:
+            processing_result['draft_status'] = 'failed'
+            print(f"Draft render failed for {processing_id}")
+        save_projects()
+    
+    def _process_video():
         try:
             print(f"Background processing thread started for {processing_id}")
             
             
             def should_stop():
+                if cancel_event.is_set():
+                    return True
                 if project_id and project_id in app.projects:
                     proc_result = app.projects[project_id]['processing_results'].get(processing_id, {})
                     return proc_result.get('stop_flag', False) or proc_result.get('status') == 'cancelled'
@@ -613,19 +675,9 @@ def start_video_processing():
                 print(f"Processing {processing_id} was stopped before starting")
                 return
             
-            editor = GuidedVideoEditor(video_path, temp_dir)
+            editor = GuidedVideoEditor(video_path, temp_dir, label_timeline=get_label_timeline(project_id, video_path))
             
-            for seg in segments:
-                
-                if should_stop():
-                    print(f"Processing {processing_id} stopped during segment addition")
-                    return
-                    
-                editor.add_segment(
-                    seg['start'],
-                    seg['end'],
-                    seg.get('room')
-                )
+            editor.add_segments([(seg['start'], seg['end'], seg.get('room')) for seg in segments])
             
             
             if should_stop():
@@ -640,6 +692,12 @@ def start_video_processing():
                 print(f"Processing {processing_id} stopped before video creation")
                 return
             
+            if draft_preview:
+                render_draft(editor)
+                if should_stop():
+                    print(f"Processing {processing_id} stopped after draft")
+                    return
+            
             if export_mode == 'segments':
                 success = editor.create_tour(temp_filename, quality=quality)
             elif export_mode == 'speedup':
@@ -728,6 +786,10 @@ def start_video_processing():
             
             
             
+            if should_stop():
+                print(f"Processing {processing_id} was superseded or stopped before completion")
+                return
+            
             if project_id and project_id in app.projects:
                 app.projects[project_id]['processing_results'][processing_id]['status'] = 'completed'
                 app.projects[project_id]['processing_results'][processing_id]['output_file'] = temp_filename
@@ -741,6 +803,8 @@ def start_video_processing():
             
         except Exception as e:
             print(f"Background processing error for {processing_id}: {e}")
+            if should_stop():
+                return
             
             if project_id and project_id in app.projects:
                 app.projects[project_id]['processing_results'][processing_id]['status'] = 'failed'
@@ -760,7 +824,8 @@ def start_video_processing():
         'project_id': project_id,
         'message': 'Video processing started in background',
         'export_mode': export_mode,
-        'segments_count': len(segments)
+        'segments_count': len(segments),
+        'draft_preview': bool(draft_preview)
     })
 
 @app.route('/stop_video_processing', methods=['POST'])
@@ -774,6 +839,9 @@ def stop_video_processing():
     
     print(f"Stopping background video processing: {processing_id}")
     
+    cancel_event = app.processing_cancel_events.get(processing_id)
+    if cancel_event is not None:
+        cancel_event.set()
     
     stopped = False
     for project_id, project in app.projects.items():
@@ -828,7 +896,9 @@ def check_processing_status(processing_id):
             'export_mode': processing_result['export_mode'],
             'segments_count': processing_result['segments_count'],
             'created_at': processing_result['created_at'],
-            'project_id': processing_result.get('project_id')
+            'project_id': processing_result.get('project_id'),
+            'draft_status': processing_result.get('draft_status'),
+            'draft_file': processing_result.get('draft_file')
         })
     elif status == 'failed':
         return jsonify({
@@ -845,7 +915,14 @@ def check_processing_status(processing_id):
             'message': 'Video still processing',
             'export_mode': processing_result['export_mode'],
             'segments_count': processing_result['segments_count'],
-            'project_id': processing_result.get('project_id')
+            'project_id': processing_result.get('project_id'),
+            'stage': processing_result.get('stage'),
+            'progress': processing_result.get('progress'),
+            'eta_seconds': processing_result.get('eta_seconds'),
+            'fps': processing_result.get('fps'),
+            'speed': processing_result.get('speed'),
+            'draft_status': processing_result.get('draft_status'),
+            'draft_file': processing_result.get('draft_file')
         })
 
 @app.route('/create_tour', methods=['POST'])
@@ -942,16 +1019,17 @@ def create_tour():
                 lf.write(base64.b64decode(agency_logo_data.split(',')[-1]))
 
         print("Adding agent/property overlays…")
-        overlay_success = add_agent_property_overlays(
-            output_filename,
-            agent_name=agent_name,
-            agent_phone=agent_phone,
-            logo_path=logo_path,
-            beds=beds,
-            baths=baths,
-            sqft=sqft,
-            qr_image_path=qr_path
-        )
+        with job_context(project_id=project_id or processing_id, priority=PRIORITY_INTERACTIVE):
+            overlay_success = add_agent_property_overlays(
+                output_filename,
+                agent_name=agent_name,
+                agent_phone=agent_phone,
+                logo_path=logo_path,
+                beds=beds,
+                baths=baths,
+                sqft=sqft,
+                qr_image_path=qr_path
+            )
         
         if not overlay_success:
             print("Failed to add overlays - using video without overlays")
@@ -1200,6 +1278,12 @@ def ai_segment_detect():
     project_id = data.get('project_id')
     detection_interval = data.get('detection_interval', 2.0)   
     unfurnished_mode = data.get('unfurnished_mode', False)   
+    image_size = data.get('image_size')
+    jpeg_quality = data.get('jpeg_quality')
+    image_detail = data.get('image_detail')
+    dedup_distance = data.get('dedup_distance')
+    sampling_mode = data.get('sampling_mode', 'uniform')
+    boundary_precision = data.get('boundary_precision')
     
     
     video_path = None
@@ -1286,6 +1370,14 @@ def ai_segment_detect():
                     session['segments'] = [s for s in session['segments'] if not (s.get('temporary') and s.get('room') == update['room'])]
                     session['segments'].append(temp_segment)
                     print(f"Room entry detected: {update['room']} at {update['time']:.1f}s")
+                elif update['type'] == 'room_update':
+                    for segment in session['segments']:
+                        if segment.get('temporary') and segment.get('room') == update['room']:
+                            segment['start'] = update['start']
+                            segment['end'] = max(segment['end'], update['time'])
+                elif update['type'] == 'label_timeline':
+                    session['label_samples'] = update['samples']
+                    session['sample_tolerance'] = update['tolerance']
                 elif update['type'] == 'progress':
                     session['progress'] = update['progress']
                 elif update['type'] == 'batch_progress':
@@ -1316,9 +1408,20 @@ def ai_segment_detect():
                 print(f"Warning: Detection session {detection_id} not found")
                 return False   
         
+        # Per-project checkpoints let a retried or restarted detection resume from its last completed batch
+        checkpoint_path = None
+        if project_id and project_id in app.projects:
+            checkpoint_name = f"detection_{sampling_mode}_{detection_interval}_{'unfurnished' if unfurnished_mode else 'furnished'}.json"
+            checkpoint_path = os.path.join('temp', project_id, checkpoint_name)
+        
         def run_detection():
             try:
-                segments = detect_room_transitions_realtime(video_path, detection_callback, detection_interval, unfurnished_mode)
+                segments = detect_room_transitions_realtime(
+                    video_path, detection_callback, detection_interval, unfurnished_mode,
+                    image_size=image_size, jpeg_quality=jpeg_quality, image_detail=image_detail,
+                    dedup_distance=dedup_distance, sampling_mode=sampling_mode,
+                    boundary_precision=boundary_precision, checkpoint_path=checkpoint_path
+                )
                 
                 
                 if project_id and project_id in app.projects and detection_id in app.projects[project_id]['detection_sessions']:
@@ -1445,7 +1548,12 @@ def auto_detect_room_label():
     try:
         
         print(f"Auto-detecting room label for segment {start_time}s - {end_time}s (unfurnished_mode: {unfurnished_mode})")
-        room_label = detect_scene_label(video_path, start_time, end_time, unfurnished_mode=unfurnished_mode)
+        label_timeline = get_label_timeline(project_id, video_path, unfurnished_mode)
+        room_label = label_timeline.lookup(start_time, end_time) if label_timeline else None
+        if room_label:
+            print(f"Room label answered from completed detection: {room_label}")
+        else:
+            room_label = detect_scene_label(video_path, start_time, end_time, unfurnished_mode=unfurnished_mode)
         
         if room_label:
             display_name = get_room_display_name(room_label)
@@ -0,0 +1,51 @@
+import bisect
+from collections import Counter
+
+
+class LabelTimeline:
+    """Time-sorted room labels from a finished detection pass, answering range queries by majority vote."""
+
+    def __init__(self, samples, tolerance=1.0):
+        labeled = sorted((float(sample['time']), sample['room']) for sample in samples if sample.get('room'))
+        self.times = [time_point for time_point, _ in labeled]
+        self.labels = [room for _, room in labeled]
+        self.tolerance = tolerance
+
+    def __len__(self):
+        return len(self.times)
+
+    def lookup(self, start_time, end_time):
+        """Majority label of the samples within ``tolerance`` of ``[start_time, end_time]``, or None if uncovered."""
+        lo = bisect.bisect_left(self.times, start_time - self.tolerance)
+        hi = bisect.bisect_right(self.times, end_time + self.tolerance)
+        if lo >= hi:
+            return None
+        votes = Counter(self.labels[lo:hi])
+        best = max(votes.values())
+        # Break ties in favour of the label nearest the middle of the range
+        middle = (start_time + end_time) / 2.0
+        candidates = [i for i in range(lo, hi) if votes[self.labels[i]] == best]
+        return self.labels[min(candidates, key=lambda i: abs(self.times[i] - middle))]
+
+
+def build_label_timeline(detection_sessions, unfurnished_mode=None, video_path=None):
+    """Index the newest completed detection session that recorded label samples.
+
+    ``detection_sessions`` is a ``{detection_id: session}`` mapping. Sessions run in a different
+    ``unfurnished_mode`` (when one is given) or on a different ``video_path`` are ignored.
+    """
+    candidates = []
+    for session in (detection_sessions or {}).values():
+        if session.get('status') != 'completed' or not session.get('label_samples'):
+            continue
+        if unfurnished_mode is not None and bool(session.get('unfurnished_mode')) != bool(unfurnished_mode):
+            continue
+        if video_path is not None and session.get('video_path') != video_path:
+            continue
+        candidates.append(session)
+
+    if not candidates:
+        return None
+    session = max(candidates, key=lambda s: s.get('created_at', ''))
+    timeline = LabelTimeline(session['label_samples'], session.get('sample_tolerance', 1.0))
+    return timeline if len(timeline) else None
@@ -1,5 +1,8 @@
 import os
 import subprocess
+from ffmpeg_scheduler import lease as ffmpeg_lease
+from ffmpeg_runner import run_ffmpeg
+from video_utils import get_fit_filter
 
 def _validate_video_file(video_path, timeout=10):
     
@@ -19,6 +22,17 @@ def _validate_video_file(video_path, timeout=10):
         return False
 
 
+def _get_video_duration(video_path, timeout=30):
+    try:
+        cmd = ['ffprobe', '-v', 'quiet', '-show_entries', 'format=duration', '-of', 'csv=p=0', str(video_path)]
+        result = subprocess.run(cmd, capture_output=True, text=True, timeout=timeout)
+        if result.returncode == 0 and result.stdout.strip():
+            return float(result.stdout.strip())
+    except (subprocess.TimeoutExpired, ValueError, FileNotFoundError) as e:
+        print(f"Could not probe duration for {video_path}: {e}")
+    return None
+
+
 def add_music_overlay(input_video, music_path, volume=0.3, output_path=None):
     input_video = str(input_video)
     music_path = str(music_path)
@@ -39,12 +53,8 @@ def add_music_overlay(input_video, music_path, volume=0.3, output_path=None):
         print(f"Creating music overlay: {input_video} → {output_path}")
     
     try:
-        probe_cmd = ['ffprobe', '-v', 'quiet', '-show_entries', 'format=duration', '-of', 'csv=p=0', input_video]
-        probe_result = subprocess.run(probe_cmd, capture_output=True, text=True, timeout=30)
-        
-        if probe_result.returncode == 0:
-            actual_video_duration = float(probe_result.stdout.strip())
-        else:
+        actual_video_duration = _get_video_duration(input_video)
+        if actual_video_duration is None:
             print(f"Warning: Could not get video duration")
             actual_video_duration = 60
         
@@ -66,14 +76,15 @@ def add_music_overlay(input_video, music_path, volume=0.3, output_path=None):
         ]
         
         print(f"Adding music overlay: volume={volume:.2f}, looping music to {actual_video_duration:.1f}s → {output_path}")
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=180)
+        with ffmpeg_lease():
+            result = run_ffmpeg(cmd, expected_duration=actual_video_duration, stage='music')
         
         if result.returncode != 0:
             print(f"Music overlay failed: {result.stderr[-300:]}")
             return False
         
     except subprocess.TimeoutExpired:
-        print("Music overlay timed out")
+        print("Music overlay stalled")
         return False
     except Exception as e:
         print(f"Music overlay error: {e}")
@@ -148,7 +159,7 @@ def add_agent_property_overlays(input_video, agent_name, agent_phone=None, logo_
     
     inputs = ['-i', input_video]
     filter_parts = []
-    filter_parts.append('[0:v]scale=1080:1920:force_original_aspect_ratio=increase,crop=1080:1920[scaled]')
+    filter_parts.append(f'[0:v]{get_fit_filter(input_video, "1080:1920")}[scaled]')
     chain_tag = 'scaled'
     idx = 1
 
@@ -291,7 +302,6 @@ def add_agent_property_overlays(input_video, agent_name, agent_phone=None, logo_
         '-c:v', 'libx264',
         '-preset', 'veryfast',  
         '-crf', '20',  
-        '-threads', '2',
         '-tune', 'fastdecode',
         '-x264-params', 'ref=1:subme=1:me=hex:trellis=0',  
         '-maxrate', '15M',  
@@ -301,15 +311,17 @@ def add_agent_property_overlays(input_video, agent_name, agent_phone=None, logo_
         '-y', output_path
     ]
 
-    print('Running optimized agent/property overlay:')
-    print(' '.join(cmd))
     try:
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=300)
+        with ffmpeg_lease() as slot:
+            cmd[-2:-2] = ['-threads', slot.threads]
+            print('Running optimized agent/property overlay:')
+            print(' '.join(cmd))
+            result = run_ffmpeg(cmd, expected_duration=_get_video_duration(input_video), stage='overlays')
         if result.returncode != 0:
             print('Overlay failed:', result.stderr[-300:])
             return False
     except subprocess.TimeoutExpired:
-        print('Overlay timed out')
+        print('Overlay stalled')
         return False
 
     if replace_in_place:
@@ -1,10 +1,48 @@
 import os
+import json
 import tempfile
 import base64
 import cv2
 import time
+import queue
+import random
+import threading
+import uuid
+import openai
+from collections import deque
 from openai import OpenAI
+from concurrent.futures import ThreadPoolExecutor, wait
 from video_utils import capture_frame, get_video_info
+from frame_sampler import sample_frames, sample_shot_frames, grab_frames_at, perceptual_hash, hash_distance
+from classification_cache import classification_cache, classification_cache_key
+from clip_cache import get_source_identity
+
+# Room classification works from layout and fixtures, so small low-detail images are enough
+CLASSIFIER_IMAGE_SIZE = int(os.getenv('SCENE_CLASSIFIER_IMAGE_SIZE', 512))
+CLASSIFIER_JPEG_QUALITY = int(os.getenv('SCENE_CLASSIFIER_JPEG_QUALITY', 80))
+CLASSIFIER_IMAGE_DETAIL = os.getenv('SCENE_CLASSIFIER_IMAGE_DETAIL', 'low')
+# Bump whenever prompts, categories or the model change so cached labels are not reused
+CLASSIFIER_PROMPT_VERSION = 'v3'
+# Token budgets for the single-image JSON reply: the normal one, then one retry if it was cut off
+CLASSIFICATION_MAX_TOKENS = (400, 800)
+
+CLASSIFIER_MAX_CONCURRENT_BATCHES = int(os.getenv('SCENE_CLASSIFIER_MAX_CONCURRENT_BATCHES', 4))
+CLASSIFIER_MAX_RETRIES = int(os.getenv('SCENE_CLASSIFIER_MAX_RETRIES', 4))
+CLASSIFIER_BACKOFF_BASE = 1.0
+CLASSIFIER_BACKOFF_MAX = 30.0
+
+DETECTION_BATCH_SIZE = 10
+DETECTION_QUEUE_SIZE = int(os.getenv('DETECTION_QUEUE_SIZE', 2 * DETECTION_BATCH_SIZE))
+# Max dHash bit distance (of 64) for a frame to reuse the label of the last classified frame; -1 disables
+DETECTION_DEDUP_DISTANCE = int(os.getenv('DETECTION_DEDUP_DISTANCE', 5))
+# Frames decoded per sampling window; the sharpest, best-exposed one is sent to the classifier
+DETECTION_SHARPNESS_CANDIDATES = int(os.getenv('DETECTION_SHARPNESS_CANDIDATES', 3))
+# 'uniform' samples every detection_interval; 'adaptive' then bisects between differing labels;
+# 'shots' sends one or two frames per visual shot found by a local colour-histogram detector
+SAMPLING_MODES = ('uniform', 'adaptive', 'shots')
+# Rooms seen for less than this are treated as pass-through glimpses and dropped
+SEGMENT_MIN_DURATION = 2.0
+DETECTION_BOUNDARY_PRECISION = float(os.getenv('DETECTION_BOUNDARY_PRECISION', 0.5))
 
 _client = None
 
@@ -18,6 +56,95 @@ def get_openai_client():
             _client = None
     return _client
 
+def _is_retryable(exc):
+    if isinstance(exc, (openai.RateLimitError, openai.APIConnectionError)):
+        return True
+    return isinstance(exc, openai.APIStatusError) and exc.status_code >= 500
+
+def _retry_after(exc):
+    response = getattr(exc, 'response', None)
+    try:
+        return float(response.headers.get('retry-after'))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+def create_chat_completion(client, **kwargs):
+    """chat.completions.create with full-jitter exponential backoff on 429, 5xx and connection errors."""
+    attempt = 0
+    while True:
+        try:
+            return client.with_options(max_retries=0).chat.completions.create(**kwargs)
+        except Exception as exc:
+            if attempt >= CLASSIFIER_MAX_RETRIES or not _is_retryable(exc):
+                raise
+            delay = random.uniform(0, min(CLASSIFIER_BACKOFF_MAX, CLASSIFIER_BACKOFF_BASE * 2 ** attempt))
+            delay = max(delay, _retry_after(exc) or 0)
+            attempt += 1
+            print(f"OpenAI request failed ({exc.__class__.__name__}), retry {attempt}/{CLASSIFIER_MAX_RETRIES} in {delay:.1f}s")
+            time.sleep(delay)
+
+def encode_image_for_classifier(image, image_size=None, jpeg_quality=None):
+    """JPEG-encode a BGR frame at classifier size and return it base64'd, or None."""
+    image_size = image_size or CLASSIFIER_IMAGE_SIZE
+    jpeg_quality = jpeg_quality or CLASSIFIER_JPEG_QUALITY
+    if image is None:
+        return None
+
+    height, width = image.shape[:2]
+    scale = image_size / max(width, height)
+    if scale < 1.0:
+        image = cv2.resize(image, (max(1, int(width * scale)), max(1, int(height * scale))), interpolation=cv2.INTER_AREA)
+
+    ok, buffer = cv2.imencode('.jpg', image, [int(cv2.IMWRITE_JPEG_QUALITY), int(jpeg_quality)])
+    if not ok:
+        return None
+    return base64.b64encode(buffer).decode('utf-8')
+
+def load_image_for_classifier(image_path, image_size=None, jpeg_quality=None):
+    return encode_image_for_classifier(cv2.imread(str(image_path)), image_size, jpeg_quality)
+
+def build_image_content(img_b64, image_detail=None):
+    return {
+        "type": "image_url",
+        "image_url": {
+            "url": f"data:image/jpeg;base64,{img_b64}",
+            "detail": image_detail or CLASSIFIER_IMAGE_DETAIL
+        }
+    }
+
+def detect_scene_labels(video_path, time_ranges, unfurnished_mode=False, video_info=None):
+    """Label many ``(start, end)`` ranges together; returns labels aligned with ``time_ranges``.
+
+    Midpoint frames are grabbed in one seek pass and classified in concurrent batches, so N
+    unlabeled segments cost about one round trip instead of N serial ones.
+    """
+    midpoints = [round((start_time + end_time) / 2.0, 3) for start_time, end_time in time_ranges]
+    if not midpoints:
+        return []
+    if get_openai_client() is None:
+        print("OPENAI_API_KEY not found – skipping automatic scene labelling")
+        return [None] * len(midpoints)
+
+    frames = []
+    # The caller is waiting on these labels, so the seeks run at its job priority rather than as background work
+    for sample in grab_frames_at(video_path, midpoints, video_info, max_side=CLASSIFIER_IMAGE_SIZE, priority=None):
+        frame_b64 = encode_image_for_classifier(sample['frame'])
+        if frame_b64 is not None:
+            frames.append({'time': sample['time'], 'base64': frame_b64, 'frame_number': sample['frame_number']})
+    if not frames:
+        print("Could not capture any frames for scene labelling")
+        return [None] * len(midpoints)
+
+    batches = [frames[i:i + DETECTION_BATCH_SIZE] for i in range(0, len(frames), DETECTION_BATCH_SIZE)]
+    labels_by_time = {}
+    with ThreadPoolExecutor(max_workers=max(1, min(CLASSIFIER_MAX_CONCURRENT_BATCHES, len(batches)))) as executor:
+        results = executor.map(lambda batch: classify_multiple_images_batch(batch, unfurnished_mode=unfurnished_mode), batches)
+        for batch, labels in zip(batches, results):
+            for frame_info, label in zip(batch, labels):
+                labels_by_time[frame_info['time']] = label
+
+    return [labels_by_time.get(midpoint) for midpoint in midpoints]
+
 def get_room_display_name(label):
     label_mapping = {
         'kitchen': 'Kitchen',
@@ -54,68 +181,29 @@ def detect_scene_label(video_path, start_time, end_time, unfurnished_mode=False)
 
     return label
 
-def estimate_room_characteristics(image_path):
-
-    client = get_openai_client()
-    if client is None:
+def classify_image_scene(image_path, confidence_threshold=0.7, unfurnished_mode=False):
+    img_b64 = load_image_for_classifier(image_path)
+    if img_b64 is None:
+        print(f"Could not read image for classification: {image_path}")
         return None
-        
-    try:
-        with open(image_path, 'rb') as f:
-            img_b64 = base64.b64encode(f.read()).decode('utf-8')
-
-        analysis_prompt = (
-            "Analyze this room image and provide characteristics that help identify if it's a bedroom or living room. "
-            "Consider:\n"
-            "1. Room size (small/medium/large)\n"
-            "2. Room proportions (square/rectangular)\n"
-            "3. Number and type of doors\n"
-            "4. Window characteristics\n"
-            "5. Presence of built-in features (closets, alcoves)\n"
-            "6. Room location hints (corner room, end of hallway, etc.)\n"
-            "7. Whether this appears to be an unfurnished property\n\n"
-            "Respond with: 'bedroom' if characteristics suggest bedroom, 'living_room' if characteristics suggest living room, or 'uncertain'."
-        )
 
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": "You are a real estate expert analyzing room characteristics."},
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": analysis_prompt},
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/jpeg;base64,{img_b64}"
-                            }
-                        }
-                    ]
-                }
-            ],
-            max_tokens=10,
-            temperature=0,
-            timeout=30
-        )
+    cache_key = classification_cache_key(img_b64, 'single', unfurnished_mode, CLASSIFIER_PROMPT_VERSION, CLASSIFIER_IMAGE_DETAIL)
+    cached_label = classification_cache.get(cache_key)
+    if cached_label:
+        print(f"Detected scene label: {cached_label} (cached)")
+        return cached_label
 
-        result = response.choices[0].message.content.strip().lower()
-        return result if result in ['bedroom', 'living_room', 'uncertain'] else 'uncertain'
-
-    except Exception as e:
-        print(f"Room characteristics analysis failed: {e}")
-        return None
-
-def classify_image_scene(image_path, confidence_threshold=0.7, unfurnished_mode=False):
     client = get_openai_client()
     if client is None:
         print("OPENAI_API_KEY not found – skipping scene classification")
         return None
-        
-    try:
-        with open(image_path, 'rb') as f:
-            img_b64 = base64.b64encode(f.read()).decode('utf-8')
 
+    label = _classify_image_scene(client, image_path, img_b64, confidence_threshold, unfurnished_mode)
+    classification_cache.put(cache_key, label)
+    return label
+
+def _classify_image_scene(client, image_path, img_b64, confidence_threshold, unfurnished_mode):
+    try:
         categories = [
             "kitchen", "bedroom", "bathroom", "living_room", "closet", 
             "office", "dining_room", "balcony"
@@ -128,7 +216,7 @@ def classify_image_scene(image_path, confidence_threshold=0.7, unfurnished_mode=
                 "CRITICAL: This is an UNFURNISHED PROPERTY. Be extremely cautious and conservative in your classification. "
                 "Focus entirely on architectural features, room layout, and intended purpose rather than furniture.\n\n"
                 "UNFURNISHED PROPERTY CLASSIFICATION GUIDELINES:\n"
-                "- BEDROOM: Limage.png ook for bedroom-specific architectural features like closet spaces, bedroom proportions, "
+                "- BEDROOM: Look for bedroom-specific architectural features like closet spaces, bedroom proportions, "
                 "bedroom windows, bedroom door locations, or bedroom layout. Even without furniture, if the room has "
                 "bedroom characteristics (size, layout, closet), classify as bedroom.\n"
                 "- LIVING ROOM: Look for living room architectural characteristics like larger open spaces, "
@@ -141,7 +229,9 @@ def classify_image_scene(image_path, confidence_threshold=0.7, unfurnished_mode=
                 "- DINING ROOM: Dining area layouts, dining room proportions, or dining room features.\n"
                 "- BALCONY: Outdoor spaces, balconies, terraces, or exterior areas.\n\n"
                 "When uncertain, prefer the more conservative classification based on room size and layout. "
-                "Respond with exactly one of the following lowercase labels and nothing else: " + ", ".join(categories) + "."
+                "Fill in every field of the response. Use 'uncertain' as the label only if none of these fit: " + ", ".join(categories) + ". "
+                "Confidence is your probability (0 to 1) that the label is correct. "
+                "Keep the reasoning to one short sentence."
             )
         else:
             system_prompt = (
@@ -163,7 +253,9 @@ def classify_image_scene(image_path, confidence_threshold=0.7, unfurnished_mode=
                 "- BALCONY: Outdoor spaces, balconies, terraces, or exterior areas.\n\n"
                 "When in doubt about an unfurnished room, consider the room's intended purpose based on "
                 "its size, location, and architectural features rather than current furniture.\n\n"
-                "Respond with exactly one of the following lowercase labels and nothing else: " + ", ".join(categories) + "."
+                "Fill in every field of the response. Use 'uncertain' as the label only if none of these fit: " + ", ".join(categories) + ". "
+                "Confidence is your probability (0 to 1) that the label is correct. "
+                "Keep the reasoning to one short sentence."
             )
 
         user_prompt = (
@@ -173,7 +265,7 @@ def classify_image_scene(image_path, confidence_threshold=0.7, unfurnished_mode=
             "Which scene type best describes this image?"
         )
 
-        response = client.chat.completions.create(
+        classification_request = dict(
             model="gpt-4o-mini",
             messages=[
                 {"role": "system", "content": system_prompt},
@@ -181,101 +273,126 @@ def classify_image_scene(image_path, confidence_threshold=0.7, unfurnished_mode=
                     "role": "user",
                     "content": [
                         {"type": "text", "text": user_prompt},
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/jpeg;base64,{img_b64}"
-                            }
-                        }
+                        build_image_content(img_b64)
                     ]
                 }
             ],
-            max_tokens=10,
+            response_format={
+                "type": "json_schema",
+                "json_schema": {
+                    "name": "scene_classification",
+                    "strict": True,
+                    "schema": {
+                        "type": "object",
+                        "properties": {
+                            "label": {"type": "string", "enum": categories + ["uncertain"]},
+                            "confidence": {"type": "number"},
+                            "room_size": {"type": "string", "enum": ["small", "medium", "large"]},
+                            "has_closet": {"type": "boolean"},
+                            "private_area": {"type": "boolean"},
+                            "furnished": {"type": "boolean"},
+                            "reasoning": {
+                                "type": "string",
+                                "description": "One short sentence, at most 25 words."
+                            }
+                        },
+                        "required": ["label", "confidence", "room_size", "has_closet", "private_area", "furnished", "reasoning"],
+                        "additionalProperties": False
+                    }
+                }
+            },
             temperature=0,
             timeout=30
         )
 
-        label = response.choices[0].message.content.strip().lower()
+        # A reply cut off at max_tokens is unparseable JSON; retry once with room to spare
+        for max_tokens in CLASSIFICATION_MAX_TOKENS:
+            response = create_chat_completion(client, max_tokens=max_tokens, **classification_request)
+            if response.choices[0].finish_reason != "length":
+                break
+            print(f"Scene classification hit the {max_tokens}-token limit")
+        else:
+            return None
+
+        try:
+            result = json.loads(response.choices[0].message.content)
+            label = str(result.get('label', '')).strip().lower()
+            confidence = float(result.get('confidence') or 0.0)
+        except (TypeError, ValueError, AttributeError) as e:
+            print(f"Could not parse scene classification response: {e}")
+            return None
 
         if label not in categories:
             print(f"AI couldn't confidently classify scene (got '{label}'), skipping label")
             return None
 
-        if label in ['bedroom', 'living_room']:
-            if unfurnished_mode:
-                verification_prompt = (
-                    "This is a follow-up analysis for an UNFURNISHED PROPERTY room classified as '" + label + "'. "
-                    "Please verify this classification by considering:\n"
-                    "1. Room size and proportions (bedrooms are typically smaller than living rooms)\n"
-                    "2. Location in the property (bedrooms are usually in private areas)\n"
-                    "3. Architectural features (closets, windows, door placement)\n"
-                    "4. Room layout and intended purpose\n\n"
-                    "For unfurnished properties, be extra conservative. If uncertain, prefer bedroom for smaller rooms. "
-                    "Respond with 'bedroom', 'living_room', or 'uncertain'."
-                )
+        evidence = (
+            f"room size {result.get('room_size')}, closet {result.get('has_closet')}, "
+            f"private area {result.get('private_area')}, furnished {result.get('furnished')}"
+        )
+        print(f"Scene classified as {label} (confidence {confidence:.2f}; {evidence}): {result.get('reasoning', '')}")
+
+        if confidence >= confidence_threshold or label not in ['bedroom', 'living_room']:
+            print(f"Detected scene label: {label}")
+            return label
+
+        # Low-confidence bedroom/living room: one follow-up, primed with the first pass's evidence
+        if unfurnished_mode:
+            verification_prompt = (
+                "This is a follow-up analysis for an UNFURNISHED PROPERTY room classified as '" + label + "'. "
+                "Please verify this classification by considering:\n"
+                "1. Room size and proportions (bedrooms are typically smaller than living rooms)\n"
+                "2. Location in the property (bedrooms are usually in private areas)\n"
+                "3. Architectural features (closets, windows, door placement)\n"
+                "4. Room layout and intended purpose\n\n"
+                "For unfurnished properties, be extra conservative. If uncertain, prefer bedroom for smaller rooms. "
+            )
+        else:
+            verification_prompt = (
+                "This is a follow-up analysis for a room classified as '" + label + "'. "
+                "Please verify this classification by considering:\n"
+                "1. Room size and proportions (bedrooms are typically smaller than living rooms)\n"
+                "2. Location in the property (bedrooms are usually in private areas)\n"
+                "3. Architectural features (closets, windows, door placement)\n"
+                "4. Whether this appears to be an unfurnished property\n\n"
+                "If this is an unfurnished property and you're uncertain, consider the room's intended purpose. "
+            )
+        verification_prompt += (
+            f"The first assessment noted: {evidence}. Reasoning: {result.get('reasoning', '')}\n\n"
+            "Respond with 'bedroom', 'living_room', or 'uncertain'."
+        )
+
+        try:
+            verification_response = create_chat_completion(client,
+                model="gpt-4o-mini",
+                messages=[
+                    {"role": "system", "content": "You are a real estate expert verifying room classifications."},
+                    {
+                        "role": "user",
+                        "content": [
+                            {"type": "text", "text": verification_prompt},
+                            build_image_content(img_b64)
+                        ]
+                    }
+                ],
+                max_tokens=10,
+                temperature=0,
+                timeout=30
+            )
+
+            verification_label = verification_response.choices[0].message.content.strip().lower()
+
+            if verification_label in ['bedroom', 'living_room']:
+                if verification_label != label:
+                    print(f"Verification changed classification from {label} to {verification_label}")
+                    return verification_label
+                print(f"Verification confirmed {label} classification")
             else:
-                verification_prompt = (
-                    "This is a follow-up analysis for a room classified as '" + label + "'. "
-                    "Please verify this classification by considering:\n"
-                    "1. Room size and proportions (bedrooms are typically smaller than living rooms)\n"
-                    "2. Location in the property (bedrooms are usually in private areas)\n"
-                    "3. Architectural features (closets, windows, door placement)\n"
-                    "4. Whether this appears to be an unfurnished property\n\n"
-                    "If this is an unfurnished property and you're uncertain, consider the room's intended purpose. "
-                    "Respond with 'bedroom', 'living_room', or 'uncertain'."
-                )
-            
-            try:
-                verification_response = client.chat.completions.create(
-                    model="gpt-4o-mini",
-                    messages=[
-                        {"role": "system", "content": "You are a real estate expert verifying room classifications."},
-                        {
-                            "role": "user",
-                            "content": [
-                                {"type": "text", "text": verification_prompt},
-                                {
-                                    "type": "image_url",
-                                    "image_url": {
-                                        "url": f"data:image/jpeg;base64,{img_b64}"
-                                    }
-                                }
-                            ]
-                        }
-                    ],
-                    max_tokens=10,
-                    temperature=0,
-                    timeout=30
-                )
-                
-                verification_label = verification_response.choices[0].message.content.strip().lower()
-                
-                if verification_label == 'uncertain':
-                    print(f"AI uncertain about {label} classification, using room characteristics analysis")
-                    characteristics = estimate_room_characteristics(image_path)
-                    if characteristics and characteristics in ['bedroom', 'living_room']:
-                        if characteristics != label:
-                            print(f"Room characteristics analysis changed classification from {label} to {characteristics}")
-                            return characteristics
-                        else:
-                            print(f"Room characteristics analysis confirmed {label} classification")
-                            return label
-                    else:
-                        print(f"Room characteristics analysis inconclusive, keeping original {label} classification")
-                        return label
-                elif verification_label in ['bedroom', 'living_room']:
-                    if verification_label != label:
-                        print(f"Verification changed classification from {label} to {verification_label}")
-                        return verification_label
-                    else:
-                        print(f"Verification confirmed {label} classification")
-                        return label
-                        
-            except Exception as e:
-                print(f"Verification failed, using original classification: {e}")
-                return label
+                print(f"AI uncertain about {label} classification, keeping it")
+
+        except Exception as e:
+            print(f"Verification failed, using original classification: {e}")
 
-        print(f"Detected scene label: {label}")
         return label
 
     except Exception as exc:
@@ -283,13 +400,33 @@ def classify_image_scene(image_path, confidence_threshold=0.7, unfurnished_mode=
         time.sleep(1)
         return None
 
-def classify_multiple_images_batch(frame_data_list, unfurnished_mode=False):
-    """Classify multiple frames in a single API call"""
+def classify_multiple_images_batch(frame_data_list, unfurnished_mode=False, image_detail=None):
+    """Classify multiple frames in a single API call, sending only frames the cache cannot answer"""
+    image_detail = image_detail or CLASSIFIER_IMAGE_DETAIL
+    cache_keys = [classification_cache_key(frame_info['base64'], 'batch', unfurnished_mode, CLASSIFIER_PROMPT_VERSION, image_detail)
+                  for frame_info in frame_data_list]
+    cached = classification_cache.get_many(cache_keys)
+    misses = [i for i, key in enumerate(cache_keys) if key not in cached]
+    if not misses:
+        print(f"All {len(frame_data_list)} frames answered from the classification cache")
+        return [cached[key] for key in cache_keys]
+    
     client = get_openai_client()
     if client is None:
         print("OPENAI_API_KEY not found – skipping scene classification")
-        return [None] * len(frame_data_list)
+        return [cached.get(key) for key in cache_keys]
+    
+    if cached:
+        print(f"{len(cached)} of {len(frame_data_list)} frames answered from the classification cache")
+    fresh = _classify_multiple_images_batch(client, [frame_data_list[i] for i in misses], unfurnished_mode, image_detail)
+    classification_cache.put_many({cache_keys[i]: label for i, label in zip(misses, fresh)})
     
+    results = [cached.get(key) for key in cache_keys]
+    for i, label in zip(misses, fresh):
+        results[i] = label
+    return results
+
+def _classify_multiple_images_batch(client, frame_data_list, unfurnished_mode, image_detail):
     try:
         categories = [
             "kitchen", "bedroom", "bathroom", "living_room", "closet", 
@@ -355,16 +492,11 @@ def classify_multiple_images_batch(frame_data_list, unfurnished_mode=False):
         
         
         for frame_info in frame_data_list:
-            content.append({
-                "type": "image_url",
-                "image_url": {
-                    "url": f"data:image/jpeg;base64,{frame_info['base64']}"
-                }
-            })
+            content.append(build_image_content(frame_info['base64'], image_detail))
         
         
         print(f"Making batch API call to classify {len(frame_data_list)} frames...")
-        response = client.chat.completions.create(
+        response = create_chat_completion(client,
             model="gpt-4o-mini",
             messages=[
                 {"role": "system", "content": system_prompt},
@@ -380,7 +512,6 @@ def classify_multiple_images_batch(frame_data_list, unfurnished_mode=False):
         print(f"Batch classification response: {result_text}")
         
         
-        import json
         try:
             
             if result_text.startswith('```'):
@@ -423,9 +554,198 @@ def classify_multiple_images_batch(frame_data_list, unfurnished_mode=False):
         return [None] * len(frame_data_list)
 
 
-def detect_room_transitions_realtime(video_path, callback_function=None, detection_interval=3.0, unfurnished_mode=False):
+class RoomSegmentBuilder:
+    """Turn in-order (time, label) samples into room segments, reporting rooms as soon as they are seen."""
+
+    def __init__(self, duration, callback_function=None, min_frames=2):
+        self.duration = duration
+        self.callback_function = callback_function
+        self.min_frames = min_frames
+        self.segments = []
+        self.current_segment = None
+
+    def _notify(self, update):
+        if self.callback_function:
+            return self.callback_function(update)
+        return None
+
+    def _progress(self, current_time):
+        return (current_time / self.duration) * 100 if self.duration else 0
+
+    def _close_current(self, progress):
+        current_segment = self.current_segment
+        if current_segment and len(current_segment['frames']) >= self.min_frames:
+            segment = {
+                'start': current_segment['start'],
+                'end': current_segment['frames'][-1]['time'],
+                'room': current_segment['room'],
+                'display_name': get_room_display_name(current_segment['room'])
+            }
+            self.segments.append(segment)
+            print(f"Segment complete: {current_segment['room']} ({segment['start']:.1f}s - {segment['end']:.1f}s)")
+            self._notify({
+                'type': 'segment_complete',
+                'segment': segment,
+                'progress': progress
+            })
+        self.current_segment = None
+
+    def _open(self, current_time, room_label):
+        self.current_segment = {
+            'start': current_time,
+            'room': room_label,
+            'frames': [{'time': current_time, 'room': room_label}]
+        }
+        print(f"Starting new segment: {room_label} at {current_time:.1f}s")
+        self._notify({
+            'type': 'room_entry',
+            'room': room_label,
+            'time': current_time,
+            'progress': self._progress(current_time)
+        })
+
+    def add(self, current_time, room_label):
+        if room_label is None:
+            print(f"Time: {current_time:.1f}s, Room: unclassified (skipping)")
+            return
 
-    print(f"Starting batched room detection for: {video_path} (unfurnished_mode: {unfurnished_mode})")
+        print(f"Time: {current_time:.1f}s, Room: {room_label}")
+        if self.current_segment is None:
+            self._open(current_time, room_label)
+        elif room_label == self.current_segment['room']:
+            self.current_segment['frames'].append({'time': current_time, 'room': room_label})
+            self._notify({
+                'type': 'room_update',
+                'room': room_label,
+                'start': self.current_segment['start'],
+                'time': current_time,
+                'progress': self._progress(current_time)
+            })
+        else:
+            self._close_current(self._progress(current_time))
+            self._open(current_time, room_label)
+
+    def finish(self, min_duration=SEGMENT_MIN_DURATION):
+        self._close_current(100)
+        return [segment for segment in self.segments if segment['end'] - segment['start'] >= min_duration]
+
+
+def refine_room_boundaries(video_path, video_info, timeline, boundary_precision, classify_frames,
+                           image_size=None, jpeg_quality=None, callback_function=None):
+    """Bisect between neighbouring samples whose labels differ until every boundary is bracketed
+    within ``boundary_precision`` seconds. ``timeline`` is a list of ``(time, label)``; the refined,
+    time-ordered timeline is returned. Each round grabs all midpoints at once and classifies them
+    with ``classify_frames``, so the cost grows with the number of room changes, not video length.
+    """
+    timeline = sorted(timeline, key=lambda sample: sample[0])
+    sampled_times = {round(time_point, 3) for time_point, _ in timeline}
+    round_num = 0
+    
+    while True:
+        labeled = [sample for sample in timeline if sample[1]]
+        midpoints = []
+        for (start, start_label), (end, end_label) in zip(labeled, labeled[1:]):
+            if start_label == end_label or end - start <= boundary_precision:
+                continue
+            midpoint = round((start + end) / 2.0, 3)
+            # A midpoint that was already tried and came back unlabeled cannot narrow the gap further
+            if midpoint not in sampled_times:
+                midpoints.append(midpoint)
+        if not midpoints:
+            break
+        
+        round_num += 1
+        print(f"Boundary refinement round {round_num}: sampling {len(midpoints)} midpoints")
+        sampled_times.update(midpoints)
+        frames = []
+        for sample in grab_frames_at(video_path, midpoints, video_info, max_side=image_size or CLASSIFIER_IMAGE_SIZE):
+            frame_b64 = encode_image_for_classifier(sample['frame'], image_size, jpeg_quality)
+            if frame_b64 is not None:
+                frames.append({'time': sample['time'], 'base64': frame_b64, 'frame_number': sample['frame_number']})
+        if not frames:
+            break
+        
+        labels = classify_frames(frames)
+        timeline = sorted(timeline + [(frame_info['time'], label) for frame_info, label in zip(frames, labels)],
+                          key=lambda sample: sample[0])
+        
+        if callback_function and callback_function({
+            'type': 'extraction_progress',
+            'frames_extracted': len(timeline),
+            'current_time': frames[-1]['time'],
+            'total_duration': video_info['duration'],
+            'progress': 90,
+            'message': f'Refining room boundaries (pass {round_num})...'
+        }) is False:
+            print("Boundary refinement stopped by callback")
+            break
+    
+    return timeline
+
+
+def detection_checkpoint_params(video_path, **params):
+    """Everything a checkpoint must match to be resumed: the source file, the sampling setup and the prompts."""
+    try:
+        source = get_source_identity(video_path)
+    except OSError:
+        return None
+    return json.loads(json.dumps({'source': source, 'prompt_version': CLASSIFIER_PROMPT_VERSION, **params}, default=str))
+
+
+def load_detection_checkpoint(checkpoint_path, params):
+    try:
+        with open(checkpoint_path, 'r') as f:
+            checkpoint = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        print(f"Ignoring unreadable detection checkpoint {checkpoint_path}: {e}")
+        return None
+    if checkpoint.get('params') != params:
+        print(f"Detection checkpoint {checkpoint_path} was made with different settings, starting over")
+        return None
+    return checkpoint
+
+
+def labelled_prefix(samples):
+    """Samples up to the first one without a label; a resume re-samples everything after it."""
+    for index, sample in enumerate(samples):
+        if not sample.get('label'):
+            return samples[:index]
+    return samples
+
+
+def save_detection_checkpoint(checkpoint_path, params, samples, complete=False):
+    """Atomically write the labelled samples so far; a crash mid-write leaves the previous checkpoint intact.
+
+    Only the contiguous labelled prefix is stored, so frames whose batch failed are retried on resume,
+    and the checkpoint is never marked complete while any label is missing.
+    """
+    resumable = labelled_prefix(samples)
+    complete = complete and len(resumable) == len(samples)
+    temp_path = f'{checkpoint_path}.{uuid.uuid4().hex[:8]}.tmp'
+    try:
+        os.makedirs(os.path.dirname(checkpoint_path) or '.', exist_ok=True)
+        with open(temp_path, 'w') as f:
+            json.dump({'params': params, 'samples': resumable, 'complete': complete}, f)
+        os.replace(temp_path, checkpoint_path)
+    except OSError as e:
+        print(f"Could not write detection checkpoint {checkpoint_path}: {e}")
+        if os.path.exists(temp_path):
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+
+
+def detect_room_transitions_realtime(video_path, callback_function=None, detection_interval=3.0, unfurnished_mode=False,
+                                     image_size=None, jpeg_quality=None, image_detail=None, dedup_distance=None,
+                                     sampling_mode='uniform', boundary_precision=None, checkpoint_path=None):
+    
+    if sampling_mode not in SAMPLING_MODES:
+        raise ValueError(f"Unknown sampling mode '{sampling_mode}', expected one of {', '.join(SAMPLING_MODES)}")
+
+    print(f"Starting batched room detection for: {video_path} (unfurnished_mode: {unfurnished_mode}, sampling: {sampling_mode})")
     
     video_info = get_video_info(video_path)
     if not video_info:
@@ -433,197 +753,283 @@ def detect_room_transitions_realtime(video_path, callback_function=None, detecti
         return []
     
     duration = video_info['duration']
-    fps = video_info['fps']
     
-    sample_interval = max(1, int(fps * detection_interval))
+    image_size = image_size or CLASSIFIER_IMAGE_SIZE
+    dedup_distance = DETECTION_DEDUP_DISTANCE if dedup_distance is None else dedup_distance
+    expected_frames = max(1, int(duration / detection_interval) + 1)
+    
+    checkpoint_params = None
+    checkpoint = None
+    if checkpoint_path:
+        checkpoint_params = detection_checkpoint_params(
+            video_path, detection_interval=detection_interval, sampling_mode=sampling_mode, unfurnished_mode=bool(unfurnished_mode),
+            image_size=image_size, jpeg_quality=jpeg_quality, image_detail=image_detail, dedup_distance=dedup_distance,
+            candidates=DETECTION_SHARPNESS_CANDIDATES
+        )
+        if checkpoint_params is not None:
+            checkpoint = load_detection_checkpoint(checkpoint_path, checkpoint_params)
+    checkpoint_samples = list(labelled_prefix(checkpoint['samples'])) if checkpoint else []
+    resume_after = checkpoint_samples[-1]['time'] if checkpoint_samples else None
+    checkpoint_complete = bool(checkpoint and checkpoint.get('complete') and len(checkpoint_samples) == len(checkpoint['samples']))
     
-    cap = cv2.VideoCapture(video_path)
+    frame_queue = queue.Queue(maxsize=DETECTION_QUEUE_SIZE)
+    stop_event = threading.Event()
+    producer_errors = []
     
-    if not cap.isOpened():
-        print("Failed to open video for room detection")
-        return []
+    def produce_frames():
+        # Producer: decode, sample and encode frames, blocking when the classifier falls behind
+        representative = None
+        # Seek past what the checkpoint already covers instead of decoding and discarding it
+        start_time = resume_after or 0.0
+        try:
+            # Inside the try so a sampler that fails to start still ends the stream for the consumer
+            if checkpoint_complete:
+                samples = iter(())
+            elif sampling_mode == 'shots':
+                samples = sample_shot_frames(video_path, video_info, max_side=image_size, start_time=start_time,
+                                             stop_event=stop_event)
+            else:
+                samples = sample_frames(video_path, detection_interval, video_info, max_side=image_size,
+                                        candidates=DETECTION_SHARPNESS_CANDIDATES, start_time=start_time)
+            for sample in samples:
+                if resume_after is not None and sample['time'] <= resume_after + 1e-6:
+                    # Already labelled in a previous run (the seek lands on its sampling window); skip before encoding
+                    continue
+                item = {'time': sample['time'], 'frame_number': sample['frame_number']}
+                if 'shot_start' in sample:
+                    item['shot_start'], item['shot_end'] = sample['shot_start'], sample['shot_end']
+                frame_hash = perceptual_hash(sample['frame']) if dedup_distance >= 0 else None
+                
+                # Never across shots: each shot's first frame is classified, so no shot boundary is lost
+                if representative is not None and frame_hash is not None and \
+                        representative['item'].get('shot_start') == item.get('shot_start') and \
+                        hash_distance(frame_hash, representative['hash']) <= dedup_distance:
+                    # Near-identical to the last frame sent for classification: inherit its label
+                    item['duplicate_of'] = representative['item']
+                else:
+                    frame_b64 = encode_image_for_classifier(sample['frame'], image_size, jpeg_quality)
+                    if frame_b64 is None:
+                        continue
+                    item['base64'] = frame_b64
+                    representative = {'item': item, 'hash': frame_hash}
+                
+                while not stop_event.is_set():
+                    try:
+                        frame_queue.put(item, timeout=0.5)
+                        break
+                    except queue.Full:
+                        continue
+                if stop_event.is_set():
+                    return
+        except Exception as e:
+            print(f"Frame sampling failed: {e}")
+            producer_errors.append(e)
+        finally:
+            while True:
+                try:
+                    frame_queue.put(None, timeout=0.5)
+                    break
+                except queue.Full:
+                    if stop_event.is_set():
+                        break
+    
+    print("Sampling and classifying frames in a pipeline...")
+    producer = threading.Thread(target=produce_frames, daemon=True)
+    producer.start()
     
-    frame_count = 0
     sampled_frames = []
+    classifications = []
+    segment_builder = RoomSegmentBuilder(duration, callback_function)
+    unresolved_frames = deque()
+    pending_batches = deque()
+    batch = []
+    batches_submitted = 0
+    batches_completed = 0
+    max_in_flight = max(1, CLASSIFIER_MAX_CONCURRENT_BATCHES)
     
-    print("Step 1: Extracting frames from video...")
+    if checkpoint_samples:
+        print(f"Resuming detection from checkpoint: {len(checkpoint_samples)} frames already labelled up to {resume_after:.1f}s")
+        for sample in checkpoint_samples:
+            item = dict(sample)
+            sampled_frames.append(item)
+            classifications.append(item['label'])
+            segment_builder.add(item['time'], item['label'])
     
+    def classify_batch(batch_num, frames):
+        print(f"Processing batch {batch_num} ({len(frames)} frames)...")
+        return classify_multiple_images_batch(frames, unfurnished_mode=unfurnished_mode, image_detail=image_detail)
     
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            break
-            
-        if frame_count % sample_interval == 0:
-            current_time = frame_count / fps
+    def resolve_frames():
+        # Hand labels to the segment builder in frame order; duplicates resolve with the frame they copy
+        while unresolved_frames:
+            frame_info = unresolved_frames[0]
+            source = frame_info.get('duplicate_of', frame_info)
+            if 'label' not in source:
+                break
+            unresolved_frames.popleft()
+            classifications.append(source['label'])
+            checkpoint_samples.append({key: frame_info[key] for key in ('time', 'frame_number', 'shot_start', 'shot_end') if key in frame_info})
+            checkpoint_samples[-1]['label'] = source['label']
+            if not stop_event.is_set():
+                segment_builder.add(frame_info['time'], source['label'])
+    
+    def collect_batches(block=False):
+        # Consume results strictly in submission order so labels line up with sampled_frames
+        nonlocal batches_completed
+        while pending_batches and (block or pending_batches[0][1].done()):
+            frames, future = pending_batches.popleft()
+            try:
+                results = future.result()
+            except Exception as e:
+                print(f"Batch {batches_completed + 1} failed: {e}")
+                results = None
+            results = results if results is not None else [None] * len(frames)
+            for frame_info, room_label in zip(frames, results):
+                frame_info['label'] = room_label
+                # Release the JPEG payload; only timing and label metadata outlive classification
+                frame_info.pop('base64', None)
+            batches_completed += 1
             
+            # Build segments as labels arrive so the editor sees rooms after the first batch
+            resolve_frames()
+            if checkpoint_params is not None:
+                save_detection_checkpoint(checkpoint_path, checkpoint_params, checkpoint_samples)
             
-            _, buffer = cv2.imencode('.jpg', frame)
-            frame_b64 = base64.b64encode(buffer).decode('utf-8')
+            if callback_function:
+                # Use 0-90% of progress bar for sampling and classification
+                batch_progress = min(90, len(classifications) / expected_frames * 90)
+                should_continue = callback_function({
+                    'type': 'batch_complete',
+                    'batch_num': batches_completed,
+                    'total_batches': max(batches_submitted, (expected_frames + DETECTION_BATCH_SIZE - 1) // DETECTION_BATCH_SIZE),
+                    'frames_processed': len(classifications),
+                    'total_frames': max(len(sampled_frames), expected_frames),
+                    'progress': batch_progress,
+                    'message': f'AI is identifying rooms...'
+                })
+                if should_continue is False:
+                    print("Detection stopped by callback")
+                    stop_event.set()
+    
+    with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+        
+        def submit_batch(frames):
+            nonlocal batches_submitted
+            batches_submitted += 1
+            future = executor.submit(classify_batch, batches_submitted, frames)
+            pending_batches.append((frames, future))
+            # Bound the work in flight so a slow API applies backpressure to the sampler
+            while len(pending_batches) > max_in_flight and not stop_event.is_set():
+                wait([pending_batches[0][1]])
+                collect_batches()
+        
+        while not stop_event.is_set():
+            try:
+                item = frame_queue.get(timeout=0.5)
+            except queue.Empty:
+                collect_batches()
+                continue
+            if item is None:
+                break
             
-            sampled_frames.append({
-                'time': current_time,
-                'base64': frame_b64,
-                'frame_number': frame_count
-            })
+            sampled_frames.append(item)
+            unresolved_frames.append(item)
+            if 'duplicate_of' not in item:
+                batch.append(item)
+            else:
+                resolve_frames()
             
             if len(sampled_frames) % 10 == 0:
-                print(f"Extracted {len(sampled_frames)} frames ({current_time:.1f}s / {duration:.1f}s)")
-                
+                print(f"Extracted {len(sampled_frames)} frames ({item['time']:.1f}s / {duration:.1f}s)")
                 if callback_function:
-                    extraction_progress = (current_time / duration) * 100
-                    callback_function({
+                    if callback_function({
                         'type': 'extraction_progress',
                         'frames_extracted': len(sampled_frames),
-                        'current_time': current_time,
+                        'current_time': item['time'],
                         'total_duration': duration,
-                        'progress': extraction_progress * 0.1,  # Reserve first 10% for extraction
+                        'progress': min(90, len(classifications) / expected_frames * 90),
                         'message': f'Analyzing video content...'
-                    })
+                    }) is False:
+                        stop_event.set()
+                        break
+            
+            if len(batch) == DETECTION_BATCH_SIZE:
+                submit_batch(batch)
+                batch = []
+            collect_batches()
         
-        frame_count += 1
-    
-    cap.release()
+        if batch and not stop_event.is_set():
+            submit_batch(batch)
+        
+        if stop_event.is_set():
+            for _, future in pending_batches:
+                future.cancel()
+        collect_batches(block=not stop_event.is_set())
     
-    print(f"Step 2: Classifying {len(sampled_frames)} frames in batched API calls...")
+    stopped_early = stop_event.is_set()
+    stop_event.set()
+    producer.join(timeout=5)
     
+    if checkpoint_params is not None and not stopped_early and not producer_errors:
+        save_detection_checkpoint(checkpoint_path, checkpoint_params, checkpoint_samples, complete=True)
     
-    BATCH_SIZE = 10
-    classifications = []
-    
-    for i in range(0, len(sampled_frames), BATCH_SIZE):
-        batch = sampled_frames[i:i+BATCH_SIZE]
-        batch_num = (i // BATCH_SIZE) + 1
-        total_batches = (len(sampled_frames) + BATCH_SIZE - 1) // BATCH_SIZE
-        
-        if callback_function:
-            # Use 10-90% of progress bar for batch processing
-            batch_progress = 10 + (i / len(sampled_frames)) * 80
-            callback_function({
-                'type': 'batch_progress',
-                'batch_num': batch_num,
-                'total_batches': total_batches,
-                'frames_processed': i,
-                'total_frames': len(sampled_frames),
-                'progress': batch_progress,
-                'message': f'AI is identifying rooms...'
-            })
-        
-        print(f"Processing batch {batch_num}/{total_batches} ({len(batch)} frames)...")
-        batch_results = classify_multiple_images_batch(batch, unfurnished_mode=unfurnished_mode)
-        classifications.extend(batch_results)
-        
-        if callback_function:
-            # Use 10-90% of progress bar for batch processing
-            batch_progress = 10 + ((i + len(batch)) / len(sampled_frames)) * 80
-            callback_function({
-                'type': 'batch_complete',
-                'batch_num': batch_num,
-                'total_batches': total_batches,
-                'frames_processed': i + len(batch),
-                'total_frames': len(sampled_frames),
-                'progress': batch_progress,
-                'message': f'Processing room data...'
-            })
+    if not sampled_frames:
+        print("Failed to sample frames for room detection")
+        return []
     
-    print(f"Step 3: Building segments from classifications...")
+    sent_frames = sum(1 for frame_info in sampled_frames if 'duplicate_of' not in frame_info)
+    print(f"Classified {sent_frames}/{len(sampled_frames)} sampled frames; {len(sampled_frames) - sent_frames} reused a neighbour's label")
     
+    # Shot segments are only measured once they span their whole shots, below
+    segments = segment_builder.finish(min_duration=0 if sampling_mode == 'shots' else SEGMENT_MIN_DURATION)
+    timeline = [(frame_info['time'], frame_info.get('duplicate_of', frame_info).get('label')) for frame_info in sampled_frames]
     
-    segments = []
-    current_segment = None
+    if sampling_mode == 'shots':
+        # Segments span whole shots rather than just the frames that represented them
+        shot_bounds = {frame_info['time']: (frame_info['shot_start'], frame_info['shot_end']) for frame_info in sampled_frames}
+        for segment in segments:
+            segment['start'] = shot_bounds.get(segment['start'], (segment['start'],))[0]
+            segment['end'] = shot_bounds.get(segment['end'], (None, segment['end']))[1]
+        # Representatives sit inside their shots, so a short single-shot room only reaches full length here
+        segments = [segment for segment in segments if segment['end'] - segment['start'] >= SEGMENT_MIN_DURATION]
+        # Extend each representative's label to the nearer edge of its shot for later range lookups
+        for time_point, room_label in list(timeline):
+            shot_start, shot_end = shot_bounds[time_point]
+            if time_point <= (shot_start + shot_end) / 2.0:
+                timeline.append((shot_start, room_label))
+            if time_point >= (shot_start + shot_end) / 2.0:
+                timeline.append((shot_end, room_label))
     
-    for i, (frame_info, room_label) in enumerate(zip(sampled_frames, classifications)):
-        current_time = frame_info['time']
+    if sampling_mode == 'adaptive' and not stopped_early:
         
-        if callback_function:
-            # Use 90-100% of progress bar for segment building
-            segment_progress = 90 + (i / len(sampled_frames)) * 10
-            should_continue = callback_function({
-                'type': 'progress',
-                'time': current_time,
-                'room': room_label,
-                'progress': segment_progress
-            })
-            if should_continue is False:
-                print("Detection stopped by callback")
-                break
+        def classify_frames(frames):
+            nonlocal batches_submitted
+            batches = [frames[i:i + DETECTION_BATCH_SIZE] for i in range(0, len(frames), DETECTION_BATCH_SIZE)]
+            batch_nums = range(batches_submitted + 1, batches_submitted + len(batches) + 1)
+            batches_submitted += len(batches)
+            with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+                results = executor.map(classify_batch, batch_nums, batches)
+                return [label for batch_labels in results for label in batch_labels]
         
-        if room_label is not None:
-            print(f"Time: {current_time:.1f}s, Room: {room_label}")
-            
-            if current_segment is None:
-                current_segment = {
-                    'start': current_time,
-                    'room': room_label,
-                    'frames': [{'time': current_time, 'room': room_label}]
-                }
-                print(f"Starting new segment: {room_label} at {current_time:.1f}s")
-                
-                if callback_function:
-                    callback_function({
-                        'type': 'room_entry',
-                        'room': room_label,
-                        'time': current_time,
-                        'progress': (current_time / duration) * 100
-                    })
-                    
-            elif room_label == current_segment['room']:
-                current_segment['frames'].append({'time': current_time, 'room': room_label})
-                print(f"Extending segment: {room_label} at {current_time:.1f}s")
-                
-            else:
-                if len(current_segment['frames']) >= 2:  
-                    segment = {
-                        'start': current_segment['start'],
-                        'end': current_segment['frames'][-1]['time'],
-                        'room': current_segment['room'],
-                        'display_name': get_room_display_name(current_segment['room'])
-                    }
-                    segments.append(segment)
-                    print(f"Segment complete: {current_segment['room']} ({segment['start']:.1f}s - {segment['end']:.1f}s)")
-                    
-                    if callback_function:
-                        callback_function({
-                            'type': 'segment_complete',
-                            'segment': segment,
-                            'progress': (current_time / duration) * 100
-                        })
-                
-                current_segment = {
-                    'start': current_time,
-                    'room': room_label,
-                    'frames': [{'time': current_time, 'room': room_label}]
-                }
-                print(f"Starting new segment: {room_label} at {current_time:.1f}s")
-                
-                if callback_function:
-                    callback_function({
-                        'type': 'room_entry',
-                        'room': room_label,
-                        'time': current_time,
-                        'progress': (current_time / duration) * 100
-                    })
-        else:
-            print(f"Time: {current_time:.1f}s, Room: unclassified (skipping)")
-    
-    if current_segment and len(current_segment['frames']) >= 2:
-        segment = {
-            'start': current_segment['start'],
-            'end': current_segment['frames'][-1]['time'],
-            'room': current_segment['room'],
-            'display_name': get_room_display_name(current_segment['room'])
-        }
-        segments.append(segment)
-        print(f"Final segment: {current_segment['room']} ({segment['start']:.1f}s - {segment['end']:.1f}s)")
-        
-        if callback_function:
-            callback_function({
-                'type': 'segment_complete',
-                'segment': segment,
-                'progress': 100
-            })
+        timeline = refine_room_boundaries(
+            video_path, video_info, timeline, boundary_precision or DETECTION_BOUNDARY_PRECISION, classify_frames,
+            image_size=image_size, jpeg_quality=jpeg_quality, callback_function=callback_function
+        )
+        # The coarse segments were only a live preview; rebuild from the refined samples
+        refined_builder = RoomSegmentBuilder(duration)
+        for time_point, room_label in timeline:
+            refined_builder.add(time_point, room_label)
+        segments = refined_builder.finish()
+        print(f"Adaptive sampling classified {len(timeline) - len(sampled_frames)} extra frames near room boundaries")
     
-    segments = [s for s in segments if s['end'] - s['start'] >= 2.0]
+    if callback_function and not stopped_early:
+        # Raw samples let later label requests for any covered range be answered without the API
+        callback_function({
+            'type': 'label_timeline',
+            'samples': [{'time': time_point, 'room': room_label} for time_point, room_label in sorted(timeline, key=lambda sample: sample[0])],
+            'tolerance': detection_interval / 2.0,
+            'progress': 100
+        })
     
     print(f"Batched room detection complete. Found {len(segments)} segments:")
     for seg in segments:
@@ -0,0 +1,53 @@
+import pytest
+
+pytest.importorskip("openai")
+
+import scene_detection  # noqa: E402
+
+SHOTS = [(0.0, 10.0, 'living_room'), (10.0, 13.0, 'bedroom'), (13.0, 30.0, 'kitchen')]
+
+
+def label_at(time_point):
+    for start, end, room in SHOTS:
+        if start <= time_point < end:
+            return room
+    return None
+
+
+@pytest.fixture
+def fake_shot_video(monkeypatch):
+    monkeypatch.setattr(scene_detection, 'get_video_info',
+                        lambda path: {'duration': 30.0, 'fps': 30, 'width': 1920, 'height': 1080})
+
+    def sample_shot_frames(video_path, video_info=None, max_side=None, start_time=0.0, stop_event=None):
+        # Representatives at one and three quarters of each shot, as the real sampler places them
+        for start, end, _ in SHOTS:
+            for offset in (0.25, 0.75):
+                time_point = round(start + (end - start) * offset, 3)
+                yield {'time': time_point, 'frame': time_point, 'frame_number': int(time_point * 30),
+                       'shot_start': start, 'shot_end': end}
+
+    monkeypatch.setattr(scene_detection, 'sample_shot_frames', sample_shot_frames)
+    monkeypatch.setattr(scene_detection, 'encode_image_for_classifier', lambda frame, *args: f'frame-{frame}')
+    monkeypatch.setattr(scene_detection, 'classify_multiple_images_batch',
+                        lambda frames, **kwargs: [label_at(frame['time']) for frame in frames])
+
+
+def test_short_single_shot_room_survives_shot_sampling(fake_shot_video):
+    segments = scene_detection.detect_room_transitions_realtime('tour.mp4', sampling_mode='shots', dedup_distance=-1)
+
+    assert [(segment['start'], segment['end'], segment['room']) for segment in segments] == [
+        (0.0, 10.0, 'living_room'),
+        (10.0, 13.0, 'bedroom'),
+        (13.0, 30.0, 'kitchen'),
+    ]
+
+
+def test_dedup_never_merges_frames_across_shots(fake_shot_video, monkeypatch):
+    # Every frame looks identical to the hash, so only the shot check keeps the rooms apart
+    monkeypatch.setattr(scene_detection, 'perceptual_hash', lambda frame: 0)
+    monkeypatch.setattr(scene_detection, 'hash_distance', lambda first, second: 0)
+
+    segments = scene_detection.detect_room_transitions_realtime('tour.mp4', sampling_mode='shots', dedup_distance=5)
+
+    assert [segment['room'] for segment in segments] == ['living_room', 'bedroom', 'kitchen']
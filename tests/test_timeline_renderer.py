@@ -0,0 +1,92 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+from timeline_renderer import build_label_filter, escape_drawtext
+
+
+def av_get_token(buf, term):
+    """Python port of libavutil's av_get_token: returns (token, rest)."""
+    out = []
+    end = 0
+    i = 0
+    while i < len(buf) and buf[i] in ' \n\t\r':
+        i += 1
+    while i < len(buf) and buf[i] not in term:
+        c = buf[i]
+        i += 1
+        if c == '\\' and i < len(buf):
+            out.append(buf[i])
+            i += 1
+            end = len(out)
+        elif c == "'":
+            while i < len(buf) and buf[i] != "'":
+                out.append(buf[i])
+                i += 1
+            if i < len(buf):
+                i += 1
+                end = len(out)
+        else:
+            out.append(c)
+    while len(out) > end and out[-1] in ' \n\t\r':
+        out.pop()
+    return ''.join(out), buf[i:]
+
+
+def expand_drawtext(text):
+    """drawtext's text expansion for literal text: a backslash makes the next character literal."""
+    out = []
+    i = 0
+    while i < len(text):
+        if text[i] == '\\' and i + 1 < len(text):
+            out.append(text[i + 1])
+            i += 2
+        else:
+            assert text[i] != '%', "unescaped % would start an expansion sequence"
+            out.append(text[i])
+            i += 1
+    return ''.join(out)
+
+
+def parse_drawtext(filtergraph):
+    """Parse one drawtext filter the way ffmpeg does and return its rendered text and other options."""
+    name, rest = av_get_token(filtergraph, "=,;[")
+    assert name == 'drawtext' and rest.startswith('=')
+    args, rest = av_get_token(rest[1:], "[],;")
+    assert rest == '', f"filtergraph continues unexpectedly: {rest!r}"
+
+    options = {}
+    while args:
+        key, args = av_get_token(args, "=")
+        assert args.startswith('='), f"option {key!r} has no value"
+        value, args = av_get_token(args[1:], ":")
+        options[key] = value
+        args = args[1:]
+    options['text'] = expand_drawtext(options['text'])
+    return options
+
+
+@pytest.mark.parametrize('label', [
+    "Master's Bedroom",
+    "Kid's Room: Blue",
+    "Living, Dining; Kitchen",
+    "Loft [upstairs]",
+    "100% Sea View",
+    "C:\\Path\\Room",
+    "''",
+])
+def test_label_filter_round_trips_special_characters(label):
+    options = parse_drawtext(build_label_filter(label, 120, 150))
+    assert options['text'] == label
+    assert options['fontfile'] == 'fonts/Poppins.ttf'
+    assert options['fontsize'] == '120'
+    assert options['y'] == 'h-text_h-150'
+
+
+def test_apostrophe_is_not_left_inside_quotes():
+    escaped = escape_drawtext("Master's Bedroom")
+    assert "\\'" in escaped
+    assert not escaped.startswith("'")
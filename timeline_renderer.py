@@ -0,0 +1,191 @@
+import os
+import re
+import subprocess
+from video_utils import find_seek_point, load_keyframe_index, plan_fit_filter, probe_video_geometry
+from ffmpeg_scheduler import lease as ffmpeg_lease
+from ffmpeg_runner import run_ffmpeg
+
+SEGMENT_LABEL_STYLE = {'fontsize': 120, 'y_offset': 150}
+SPEEDUP_TOUR_LABEL_STYLE = {'fontsize': 70, 'y_offset': 200}
+
+# Gaps shorter than this are decoded through rather than re-seeked
+INPUT_GAP_SECONDS = 5.0
+
+
+def escape_drawtext(text):
+    """Escape ``text`` for an unquoted ``drawtext=text=`` value inside a filtergraph.
+
+    Three parsers unescape it in turn: the filtergraph (``\\ ' [ ] , ;``), the filter's option
+    string (``\\ ' :``) and drawtext's own text expansion (``\\ %``). Quoting is avoided because a
+    backslash cannot escape an apostrophe inside single quotes.
+    """
+    text = str(text)
+    text = re.sub(r"([\\%])", r"\\\1", text)
+    text = re.sub(r"([\\':])", r"\\\1", text)
+    text = re.sub(r"([\\'\[\],;])", r"\\\1", text)
+    return text
+
+
+def build_label_filter(text, fontsize, y_offset):
+    return (
+        f"drawtext=text={escape_drawtext(text)}:fontfile=fonts/Poppins.ttf:"
+        f"fontsize={fontsize}:fontcolor=white:shadowcolor=black@0.8:shadowx=4:shadowy=4:"
+        f"x=(w-text_w)/2:y=h-text_h-{y_offset}"
+    )
+
+
+def build_fit_filter(target_resolution='1080:1920', geometry=None):
+    return plan_fit_filter(geometry, target_resolution)
+
+
+def _atempo_chain(speed):
+    # atempo only accepts 0.5-2.0 per instance on older ffmpeg builds
+    filters = []
+    remaining = float(speed)
+    while remaining > 2.0:
+        filters.append('atempo=2.0')
+        remaining /= 2.0
+    while remaining < 0.5:
+        filters.append('atempo=0.5')
+        remaining /= 0.5
+    if abs(remaining - 1.0) > 1e-6:
+        filters.append(f'atempo={remaining:.6f}')
+    return filters
+
+
+def plan_timeline_inputs(video_path, parts, max_gap=INPUT_GAP_SECONDS):
+    """Group consecutive parts into seek windows so long gaps between parts are never decoded."""
+    keyframes = load_keyframe_index(video_path)
+    inputs = []
+    for i, part in enumerate(parts):
+        current = inputs[-1] if inputs else None
+        if current and current['end'] - 0.001 <= part['start'] <= current['end'] + max_gap:
+            current['end'] = max(current['end'], part['end'])
+            current['parts'].append(i)
+            continue
+
+        seek = find_seek_point(keyframes, part['start'])
+        if seek is None:
+            seek = part['start']
+        inputs.append({'seek': seek, 'end': part['end'], 'parts': [i]})
+    return inputs
+
+
+def build_timeline_filtergraph(parts, inputs, target_resolution='1080:1920', silent_mode=True, geometry=None):
+    """Build one filter_complex that trims, retimes, frames and labels every part and concatenates them."""
+    graph = []
+    part_inputs = {}
+    for input_index, timeline_input in enumerate(inputs):
+        count = len(timeline_input['parts'])
+        graph.append(f'[{input_index}:v]split={count}' + ''.join(f'[vin{i}]' for i in timeline_input['parts']))
+        if not silent_mode:
+            graph.append(f'[{input_index}:a]asplit={count}' + ''.join(f'[ain{i}]' for i in timeline_input['parts']))
+        for i in timeline_input['parts']:
+            part_inputs[i] = timeline_input
+
+    fit_filter = build_fit_filter(target_resolution, geometry)
+    concat_inputs = []
+    for i, part in enumerate(parts):
+        input_offset = part_inputs[i]['seek']
+        start = max(0.0, part['start'] - input_offset)
+        end = max(start, part['end'] - input_offset)
+        speed = float(part.get('speed', 1.0) or 1.0)
+
+        video_chain = [f'trim=start={start:.3f}:end={end:.3f}']
+        if speed != 1.0:
+            video_chain.append(f'setpts=(PTS-STARTPTS)/{speed}')
+        else:
+            video_chain.append('setpts=PTS-STARTPTS')
+        video_chain.append(fit_filter)
+
+        label = part.get('label')
+        if label:
+            style = part.get('label_style') or SEGMENT_LABEL_STYLE
+            video_chain.append(build_label_filter(label, style['fontsize'], style['y_offset']))
+
+        video_chain.extend(part.get('extra_filters') or [])
+
+        graph.append(f'[vin{i}]' + ','.join(video_chain) + f'[v{i}]')
+        concat_inputs.append(f'[v{i}]')
+
+        if not silent_mode:
+            audio_chain = [f'atrim=start={start:.3f}:end={end:.3f}', 'asetpts=PTS-STARTPTS']
+            audio_chain.extend(_atempo_chain(speed))
+            graph.append(f'[ain{i}]' + ','.join(audio_chain) + f'[a{i}]')
+            concat_inputs.append(f'[a{i}]')
+
+    audio_streams = 0 if silent_mode else 1
+    output_pads = '[outv]' if silent_mode else '[outv][outa]'
+    graph.append(''.join(concat_inputs) + f'concat=n={len(parts)}:v=1:a={audio_streams}' + output_pads)
+
+    return ';'.join(graph)
+
+
+def get_timeline_duration(parts):
+    return sum((part['end'] - part['start']) / float(part.get('speed', 1.0) or 1.0) for part in parts)
+
+
+def render_timeline(video_path, video_info, parts, output_path, encoder_args, target_resolution='1080:1920',
+                    silent_mode=True):
+    """Render the whole timeline with a single decode and a single encode.
+
+    Parts that sit close together share one seeked input; distant parts get their own input so
+    the frames between them are never decoded.
+
+    ``parts`` is an ordered list of dicts with ``start``/``end`` in source seconds and optional
+    ``speed``, ``label``, ``label_style`` and ``extra_filters`` keys.
+    """
+    parts = [part for part in parts if part['end'] - part['start'] > 0.01]
+    if not parts:
+        print("No timeline parts to render")
+        return False
+
+    inputs = plan_timeline_inputs(video_path, parts)
+    filter_complex = build_timeline_filtergraph(parts, inputs, target_resolution, silent_mode,
+                                                probe_video_geometry(video_path))
+
+    cmd = ['ffmpeg']
+    for timeline_input in inputs:
+        cmd.extend([
+            '-ss', f"{timeline_input['seek']:.3f}",
+            '-t', f"{timeline_input['end'] - timeline_input['seek']:.3f}",
+            '-i', str(video_path)
+        ])
+    cmd.extend(['-filter_complex', filter_complex, '-map', '[outv]'])
+    if silent_mode:
+        cmd.append('-an')
+    else:
+        cmd.extend(['-map', '[outa]', '-c:a', 'aac', '-b:a', '192k'])
+    cmd.extend(encoder_args)
+    cmd.extend(['-movflags', '+faststart', '-y', str(output_path)])
+
+    output_duration = get_timeline_duration(parts)
+    print(f"Single-pass timeline render: {len(parts)} parts from {len(inputs)} seek windows, {output_duration:.1f}s output → {output_path}")
+
+    try:
+        with ffmpeg_lease() as slot:
+            cmd[-2:-2] = ['-threads', slot.threads]
+            result = run_ffmpeg(cmd, expected_duration=output_duration, stage='render')
+    except subprocess.TimeoutExpired:
+        print("Timeline render stalled")
+        if os.path.exists(output_path):
+            try:
+                os.remove(output_path)
+            except OSError:
+                pass
+        return False
+    except Exception as e:
+        print(f"Timeline render error: {e}")
+        return False
+
+    if result.returncode != 0:
+        print(f"Timeline render failed: {result.stderr[-500:]}")
+        return False
+
+    if not os.path.exists(output_path) or os.path.getsize(output_path) < 1000:
+        print(f"Timeline render produced an invalid file: {output_path}")
+        return False
+
+    file_size = os.path.getsize(output_path) / (1024 * 1024)
+    print(f"Timeline rendered: {output_path} ({file_size:.1f}MB)")
+    return True
@@ -1,9 +1,26 @@
 import os
 import tempfile
+import threading
 import subprocess
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
-from video_utils import get_quality_settings
-from video_processor import extract_clip_simple, extract_clip_hq, combine_clips, combine_clips_hq, extract_clips_parallel
+from video_utils import get_quality_settings, get_fit_filter
+from video_processor import extract_clip_simple, extract_clip_hq, hq_clip_cache_key, combine_clips, combine_clips_hq, extract_clips_parallel
+from clip_cache import clip_cache
+from ffmpeg_scheduler import lease as ffmpeg_lease, scheduler as ffmpeg_scheduler, submit_in_context
+from ffmpeg_runner import run_ffmpeg, FFmpegCancelled, ProgressAggregator
+from timeline_renderer import render_timeline, escape_drawtext, SEGMENT_LABEL_STYLE, SPEEDUP_TOUR_LABEL_STYLE
+
+DRAFT_RESOLUTION = '540:960'
+DRAFT_ENCODER_ARGS = [
+    '-c:v', 'libx264',
+    '-preset', 'ultrafast',
+    '-crf', '28',
+    '-r', '30',
+    '-g', '60',
+    '-tune', 'fastdecode'
+]
 
 def number_duplicate_segments(segments):
 
@@ -43,9 +60,39 @@ def create_tour_simple(user_segments, video_path, video_info, output_path="guide
     for i, segment in enumerate(sorted_segments):
         segment['display_name'] = display_names.get(i, segment.get('label'))
     
+    parts = [{
+        'start': segment['start_time'],
+        'end': segment['end_time'],
+        'label': segment['display_name'],
+        'label_style': SEGMENT_LABEL_STYLE
+    } for segment in sorted_segments]
+    
+    encoder_args = [
+        '-c:v', 'libx264',
+        '-preset', 'veryfast',
+        '-crf', '20',
+        '-r', '30',
+        '-g', '30',
+        '-keyint_min', '30',
+        '-sc_threshold', '0',
+        '-maxrate', '15M',
+        '-bufsize', '15M',
+        '-tune', 'fastdecode',
+        '-x264-params', 'ref=1:subme=1:me=hex:trellis=0'
+    ]
+    success = render_timeline(video_path, video_info, parts, output_path, encoder_args)
+    
+    if success:
+        print(f"OPTIMIZED SIMPLE tour created: {output_path}")
+        return True
+    
+    print("Single-pass render failed, falling back to per-clip extraction")
+    return _create_tour_simple_from_clips(sorted_segments, video_path, video_info, output_path, project_temp_dir)
+
+def _create_tour_simple_from_clips(sorted_segments, video_path, video_info, output_path, project_temp_dir=None):
     temp_dir = project_temp_dir or 'temp'
     os.makedirs(temp_dir, exist_ok=True)
-    
+    run_id = uuid.uuid4().hex[:8]
     
     if len(sorted_segments) > 1:
         print("Using parallel clip extraction for better performance...")
@@ -54,7 +101,7 @@ def create_tour_simple(user_segments, video_path, video_info, output_path="guide
         
         temp_clips = []
         for i, segment in enumerate(sorted_segments):
-            clip_path = os.path.join(temp_dir, f"simple_clip_{i}.mp4")
+            clip_path = os.path.join(temp_dir, f"simple_clip_{run_id}_{i}.mp4")
             
             success = extract_clip_simple(
                 video_path, video_info, segment['start_time'], segment['end_time'], 
@@ -84,11 +131,8 @@ def create_tour_simple(user_segments, video_path, video_info, output_path="guide
     
     return success
 
-def create_speedup_tour_simple(user_segments, video_path, video_info, output_path="guided_tour_ffmpeg.mp4", speed_factor=3.0, project_temp_dir=None):
-    if not user_segments:
-        print("No segments selected!")
-        return False
-
+def build_speedup_timeline(user_segments, video_info, speed_factor=3.0):
+    """Return the speedup ``timeline`` (segments plus sped-up gaps) and its render parts."""
     display_names = number_duplicate_segments(user_segments)
     
     
@@ -123,144 +167,163 @@ def create_speedup_tour_simple(user_segments, video_path, video_info, output_pat
         })
 
     
-    temp_dir = project_temp_dir or 'temp'
-    os.makedirs(temp_dir, exist_ok=True)
-    
-    import uuid
-    concat_file = os.path.join(temp_dir, f'speedup_concat_{uuid.uuid4().hex[:8]}.txt')
-    
-    
-    part_paths = []
-    for i, part in enumerate(timeline):
-        start_time = part['start']
-        end_time = part['end']
-        duration = end_time - start_time
-        
-        part_filename = f"part_{i}.mp4"
-        part_path = os.path.join(temp_dir, part_filename)
-        part_paths.append(part_path)
-        
-        base_cmd = [
-            'ffmpeg', '-ss', str(start_time), '-t', str(duration),
-            '-i', str(video_path),
-            '-vf'
-        ]
-        
+    parts = []
+    for part in timeline:
         if part['speed'] > 1.0:
-            filter_str = f"setpts=PTS/{part['speed']},scale=1080:1920:force_original_aspect_ratio=increase,crop=1080:1920"
-            print(f"Speedup gap: {start_time:.1f}s to {end_time:.1f}s at {part['speed']}x (9:16)")
+            parts.append({'start': part['start'], 'end': part['end'], 'speed': part['speed']})
         else:
-            filters = [
-                "setpts=PTS*1",  
-                "scale=1080:1920:force_original_aspect_ratio=increase,crop=1080:1920"
-            ]
-            if part.get('display_name'):
-                display_text = part['display_name']
-                text_overlay = (
-                    f"drawtext=text='{display_text}':fontfile=fonts/Poppins.ttf:"
-                    f"fontsize=70:fontcolor=white:shadowcolor=black@0.8:shadowx=4:shadowy=4:"
-                    f"x=(w-text_w)/2:y=h-text_h-200"
-                )
-                filters.append(text_overlay)
-            filter_str = ",".join(filters)
-            print(f"Normal segment: {start_time:.1f}s to {end_time:.1f}s (9:16) with label {part.get('display_name', part.get('label'))}")
-
-        cmd = base_cmd + [
-            filter_str, 
-            '-an', 
-            '-c:v', 'libx264', 
-            '-preset', 'veryfast',  
-            '-crf', '20',  
-            '-r', '30',    
-            '-g', '30',    
-            '-keyint_min', '30',  
-            '-sc_threshold', '0',  
-            '-maxrate', '15M',  
-            '-bufsize', '15M',
-            '-y', part_path
-        ]
-        
-        from video_processor import _get_concurrent_resource_settings, _release_ffmpeg_process
-        resource_settings = _get_concurrent_resource_settings()
-        
-        base_timeout = max(30, int(duration * 1.5))  
-        timeout_duration = int(base_timeout * resource_settings['timeout_multiplier'])
-        
-        try:
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=timeout_duration)
-        except subprocess.TimeoutExpired:
-            print(f"Part {i+1} timeout after {timeout_duration}s")
-            _release_ffmpeg_process()
-            return False
+            parts.append({
+                'start': part['start'],
+                'end': part['end'],
+                'label': part.get('display_name'),
+                'label_style': SPEEDUP_TOUR_LABEL_STYLE
+            })
+    
+    return timeline, parts
 
-        if result.returncode != 0:
-            print(f"Part {i+1} failed: {result.stderr[-300:]}")
-            _release_ffmpeg_process()
-            return False
-            
-        print(f"Part {i+1} created: {part_filename}")
-        _release_ffmpeg_process()
+def create_speedup_tour_simple(user_segments, video_path, video_info, output_path="guided_tour_ffmpeg.mp4", speed_factor=3.0, project_temp_dir=None):
+    if not user_segments:
+        print("No segments selected!")
+        return False
 
+    timeline, parts = build_speedup_timeline(user_segments, video_info, speed_factor)
     
-    with open(concat_file, 'w') as f:
-        for part_path in part_paths:
-            f.write(f"file '{os.path.abspath(part_path)}'\n")
-
+    encoder_args = [
+        '-c:v', 'libx264',
+        '-preset', 'veryfast',
+        '-crf', '20',
+        '-r', '30',
+        '-g', '30',
+        '-keyint_min', '30',
+        '-sc_threshold', '0',
+        '-maxrate', '15M',
+        '-bufsize', '15M'
+    ]
+    print(f"Speedup timeline: {len(parts)} parts at {speed_factor}x gaps (9:16)")
     
-    from video_processor import _get_concurrent_resource_settings, _release_ffmpeg_process
-    resource_settings = _get_concurrent_resource_settings()
+    # Parts render in parallel across every ffmpeg slot; with a single slot they would run one after
+    # another and then need a concat, which is slower than one single-pass render
+    if ffmpeg_scheduler.max_slots > 1:
+        if _create_speedup_tour_from_parts(timeline, video_path, output_path, project_temp_dir):
+            print(f"FAST speedup tour created: {output_path}")
+            return True
+        print("Parallel part rendering failed, falling back to single-pass render")
     
-    combine_cmd = [
-        'ffmpeg', '-f', 'concat', '-safe', '0',
-        '-i', concat_file,
-        '-c:v', 'libx264',
+    success = render_timeline(video_path, video_info, parts, output_path, encoder_args)
+    if success:
+        print(f"FAST speedup tour created: {output_path}")
+    return success
+
+def _render_speedup_part(part, index, video_path, part_path, cancel_event=None):
+    start_time = part['start']
+    end_time = part['end']
+    duration = end_time - start_time
+    
+    base_cmd = [
+        'ffmpeg', '-ss', str(start_time), '-t', str(duration),
+        '-i', str(video_path),
+        '-vf'
+    ]
+    
+    fit_filter = get_fit_filter(video_path, '1080:1920')
+    if part['speed'] > 1.0:
+        filter_str = f"setpts=PTS/{part['speed']},{fit_filter}"
+        print(f"Speedup gap: {start_time:.1f}s to {end_time:.1f}s at {part['speed']}x (9:16)")
+    else:
+        filters = [
+            "setpts=PTS*1",  
+            fit_filter
+        ]
+        if part.get('display_name'):
+            display_text = part['display_name']
+            text_overlay = (
+                f"drawtext=text={escape_drawtext(display_text)}:fontfile=fonts/Poppins.ttf:"
+                f"fontsize=70:fontcolor=white:shadowcolor=black@0.8:shadowx=4:shadowy=4:"
+                f"x=(w-text_w)/2:y=h-text_h-200"
+            )
+            filters.append(text_overlay)
+        filter_str = ",".join(filters)
+        print(f"Normal segment: {start_time:.1f}s to {end_time:.1f}s (9:16) with label {part.get('display_name', part.get('label'))}")
+
+    cmd = base_cmd + [
+        filter_str, 
+        '-an', 
+        '-c:v', 'libx264', 
         '-preset', 'veryfast',  
         '-crf', '20',  
-        '-r', '30',  
-        '-g', '30',  
+        '-r', '30',    
+        '-g', '30',    
+        '-keyint_min', '30',  
+        '-sc_threshold', '0',  
         '-maxrate', '15M',  
         '-bufsize', '15M',
-        '-movflags', '+faststart',
-        '-threads', resource_settings['threads'],
-        '-y', output_path
+        '-movflags', '+faststart'
     ]
     
-    base_timeout = 120 if len(timeline) > 10 else 90  
-    timeout_duration = int(base_timeout * resource_settings['timeout_multiplier'])
-    
-    print(f"FAST combining {len(timeline)} parts: {resource_settings['threads']} threads, {timeout_duration}s timeout")
-    
     try:
-        result = subprocess.run(combine_cmd, capture_output=True, text=True, timeout=timeout_duration)
+        with ffmpeg_lease() as slot:
+            result = run_ffmpeg(cmd + ['-threads', slot.threads, '-y', part_path], expected_duration=duration / part['speed'],
+                                stage=f'part {index+1}', cancel_event=cancel_event)
     except subprocess.TimeoutExpired:
-        print(f"Combine timeout after {timeout_duration}s")
-        _release_ffmpeg_process()
+        print(f"Part {index+1} stalled")
         return False
-    finally:
-        
-        if os.path.exists(concat_file):
-            os.remove(concat_file)
-        for part_path in part_paths:
-            if os.path.exists(part_path):
-                os.remove(part_path)
-
-    if result.returncode == 0:
-        print(f"FAST speedup tour created: {output_path}")
-        _release_ffmpeg_process()
-        return True
-    else:
-        print(f"Combine failed: {result.stderr[-300:]}")
-        _release_ffmpeg_process()
+    except FFmpegCancelled:
+        print(f"Part {index+1} cancelled")
         return False
 
-def create_tour(user_segments, video_path, video_info, output_path="guided_tour.mp4", api_key=None, quality='professional', project_temp_dir=None):
-    if not user_segments:
-        print("No segments selected!")
+    if result.returncode != 0:
+        print(f"Part {index+1} failed: {result.stderr[-300:]}")
         return False
+        
+    print(f"Part {index+1} created: {os.path.basename(part_path)}")
+    return True
+
+def _create_speedup_tour_from_parts(timeline, video_path, output_path, project_temp_dir=None):
+    temp_dir = project_temp_dir or 'temp'
+    os.makedirs(temp_dir, exist_ok=True)
     
-    quality_settings = get_quality_settings(quality)
-    print(f"Creating {quality} quality tour from {len(user_segments)} segments...")
+    run_id = uuid.uuid4().hex[:8]
+    part_paths = [os.path.join(temp_dir, f"part_{run_id}_{i}.mp4") for i in range(len(timeline))]
+    
+    # Parts are independent: render them concurrently and stop the siblings as soon as one fails
+    cancel_event = threading.Event()
+    max_workers = max(1, min(ffmpeg_scheduler.max_slots, len(timeline)))
+    print(f"Rendering {len(timeline)} speedup parts with {max_workers} workers")
     
+    progress = ProgressAggregator('parts', [(part['end'] - part['start']) / part['speed'] for part in timeline])
+    success = True
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                submit_in_context(executor, progress.track(i, _render_speedup_part), part, i, video_path, part_paths[i], cancel_event): i
+                for i, part in enumerate(timeline)
+            }
+            for future in as_completed(futures):
+                index = futures[future]
+                if future.cancelled():
+                    continue
+                try:
+                    part_ok = future.result()
+                except Exception as e:
+                    print(f"Part {index+1} error: {e}")
+                    part_ok = False
+                if not part_ok and success:
+                    success = False
+                    cancel_event.set()
+                    for pending in futures:
+                        pending.cancel()
+        
+        if not success:
+            return False
+        
+        return combine_clips(part_paths, output_path, silent_mode=True, project_temp_dir=temp_dir)
+    finally:
+        for part_path in part_paths:
+            if os.path.exists(part_path):
+                os.remove(part_path)
+
+def build_tour_parts(user_segments, video_info):
+    """Return the sorted segments, their display names and the render parts of a segments tour."""
     display_names = number_duplicate_segments(user_segments)
     
     enhanced = []
@@ -277,14 +340,93 @@ def create_tour(user_segments, video_path, video_info, output_path="guided_tour.
     
     enhanced.sort(key=lambda x: x['start_time'])
     
+    parts = []
+    for i, segment in enumerate(enhanced):
+        display_name = display_names.get(i, segment['label'])
+        if segment['speed_factor'] != 1.0:
+            label_style = {'fontsize': max(36, video_info.get('width', 1920) // 40) * 1.5, 'y_offset': 275}
+        else:
+            label_style = SEGMENT_LABEL_STYLE
+        parts.append({
+            'start': segment['start_time'],
+            'end': segment['end_time'],
+            'speed': segment['speed_factor'],
+            'label': display_name,
+            'label_style': label_style
+        })
+    
+    return enhanced, display_names, parts
+
+def create_tour(user_segments, video_path, video_info, output_path="guided_tour.mp4", api_key=None, quality='professional', project_temp_dir=None):
+    if not user_segments:
+        print("No segments selected!")
+        return False
+    
+    quality_settings = get_quality_settings(quality)
+    print(f"Creating {quality} quality tour from {len(user_segments)} segments...")
+    
+    enhanced, display_names, parts = build_tour_parts(user_segments, video_info)
     
+    encoder_args = [
+        '-c:v', 'libx264',
+        '-preset', quality_settings['preset'],
+        '-crf', quality_settings['crf']
+    ]
+    if quality_settings.get('memory_optimized', False):
+        encoder_args.extend([
+            '-tune', 'fastdecode',
+            '-x264-params', 'ref=2:subme=2:me=hex:trellis=0:8x8dct=0'
+        ])
+    if quality_settings['maxrate'] != 'unlimited':
+        encoder_args.extend(['-maxrate', quality_settings['maxrate'], '-bufsize', quality_settings['bufsize']])
+    
+    # Pick the cheaper strategy. Per-segment clips cost an extra concat, but they reuse cached clips
+    # and run on several ffmpeg slots at once. With no cached clip and a single slot there is nothing
+    # to win back, so one single-pass render of the timeline is cheaper.
+    cached_clips = count_cached_tour_clips(enhanced, display_names, video_path, video_info, quality_settings)
+    if cached_clips == 0 and ffmpeg_scheduler.max_slots <= 1:
+        print("No cached clips and a single ffmpeg slot: rendering the tour in one pass")
+        if render_timeline(
+            video_path, video_info, parts, output_path, encoder_args,
+            target_resolution=quality_settings['target_resolution']
+        ):
+            return True
+        print("Single-pass render failed, falling back to per-clip extraction")
+        return _create_tour_from_clips(enhanced, display_names, video_path, video_info, output_path, quality_settings, project_temp_dir)
+    
+    print(f"{cached_clips}/{len(enhanced)} clips cached, {ffmpeg_scheduler.max_slots} ffmpeg slots: exporting per clip")
+    success = _create_tour_from_clips(enhanced, display_names, video_path, video_info, output_path, quality_settings, project_temp_dir)
+    if success:
+        return True
+    
+    print("Per-clip export failed, falling back to single-pass render")
+    return render_timeline(
+        video_path, video_info, parts, output_path, encoder_args,
+        target_resolution=quality_settings['target_resolution']
+    )
+
+def count_cached_tour_clips(enhanced, display_names, video_path, video_info, quality_settings):
+    """How many of the tour's per-segment clips the clip cache could serve without rendering."""
+    if not clip_cache.enabled:
+        return 0
+    return sum(
+        1 for i, segment in enumerate(enhanced)
+        if clip_cache.contains(hq_clip_cache_key(
+            video_path, video_info, segment['start_time'], segment['end_time'],
+            speed_factor=segment['speed_factor'], quality_settings=quality_settings,
+            silent_mode=True, room_type=display_names.get(i, segment['label'])
+        ))
+    )
+
+def _create_tour_from_clips(enhanced, display_names, video_path, video_info, output_path, quality_settings, project_temp_dir=None):
     temp_dir = project_temp_dir or 'temp'
     os.makedirs(temp_dir, exist_ok=True)
     
-    temp_clips = []
-    for i, segment in enumerate(enhanced):
-        clip_path = os.path.join(temp_dir, f"temp_hq_clip_{i}.mp4")
-        
+    # Per-run names so a superseded export still winding down cannot delete or overwrite these clips
+    run_id = uuid.uuid4().hex[:8]
+    
+    def extract_segment(i, segment):
+        clip_path = os.path.join(temp_dir, f"temp_hq_clip_{run_id}_{i}.mp4")
         display_name = display_names.get(i, segment['label'])
         
         success = extract_clip_hq(
@@ -294,20 +436,66 @@ def create_tour(user_segments, video_path, video_info, output_path="guided_tour.
         )
         
         if success:
-            temp_clips.append(clip_path)
             speed_text = f" ({segment['speed_factor']}x)" if segment['speed_factor'] != 1.0 else ""
             print(f"HQ Clip {i+1}: {segment['scene_type']}{speed_text} ({segment['duration']:.1f}s)")
-        else:
-            print(f"Failed to extract HQ clip {i+1}")
-    
-    if temp_clips:
-        success = combine_clips_hq(temp_clips, output_path, quality_settings)
-    else:
-        print("No clips to combine")
+            return clip_path
+        print(f"Failed to extract HQ clip {i+1}")
+        return None
+    
+    # One worker per ffmpeg slot; the scheduler sizes each slot's threads so all slots together fill the CPU quota
+    max_workers = max(1, min(ffmpeg_scheduler.max_slots, len(enhanced)))
+    print(f"Extracting {len(enhanced)} HQ clips with {max_workers} workers ({ffmpeg_scheduler.threads_per_slot} threads each)")
+    
+    progress = ProgressAggregator('clips', [segment['duration'] / segment['speed_factor'] for segment in enhanced])
+    extracted = [None] * len(enhanced)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            submit_in_context(executor, progress.track(i, extract_segment), i, segment): i
+            for i, segment in enumerate(enhanced)
+        }
+        for future in as_completed(futures):
+            index = futures[future]
+            try:
+                extracted[index] = future.result()
+            except Exception as e:
+                print(f"HQ clip {index+1} error: {e}")
+    
+    temp_clips = [clip for clip in extracted if clip]
+    
+    if len(temp_clips) != len(enhanced):
+        print(f"Only {len(temp_clips)}/{len(enhanced)} HQ clips extracted")
         success = False
+    else:
+        success = combine_clips_hq(temp_clips, output_path, quality_settings, project_temp_dir)
     
     for clip in temp_clips:
         if os.path.exists(clip):
             os.unlink(clip)
     
-    return success 
\ No newline at end of file
+    return success 
+
+def create_draft_tour(user_segments, video_path, video_info, output_path, export_mode='segments', speed_factor=3.0,
+                      extra_filters=None):
+    """Render a fast low-resolution preview of the same timeline, labels and filters as the final export."""
+    if not user_segments:
+        print("No segments selected!")
+        return False
+    
+    if export_mode == 'speedup':
+        _, parts = build_speedup_timeline(user_segments, video_info, speed_factor)
+    else:
+        _, _, parts = build_tour_parts(user_segments, video_info)
+    
+    # Label sizes are in output pixels, so shrink them with the frame
+    scale = int(DRAFT_RESOLUTION.split(':')[0]) / 1080
+    for part in parts:
+        if part.get('label'):
+            style = part.get('label_style') or SEGMENT_LABEL_STYLE
+            part['label_style'] = {'fontsize': int(style['fontsize'] * scale), 'y_offset': int(style['y_offset'] * scale)}
+        if extra_filters:
+            part['extra_filters'] = list(extra_filters)
+    
+    print(f"Draft render: {len(parts)} parts at {DRAFT_RESOLUTION} ({export_mode})")
+    return render_timeline(video_path, video_info, parts, output_path, DRAFT_ENCODER_ARGS,
+                           target_resolution=DRAFT_RESOLUTION)
+
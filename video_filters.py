@@ -1,6 +1,8 @@
 import os
 import subprocess
 from typing import Dict, List, Optional, Union
+from ffmpeg_scheduler import lease as ffmpeg_lease
+from ffmpeg_runner import run_ffmpeg
 
 class VideoFilterEngine:
 
@@ -120,6 +122,17 @@ class VideoFilterEngine:
         
         return filters
 
+    def get_filter_chain(self, filter_settings: Dict) -> List[str]:
+
+        filters = []
+        preset_name = filter_settings.get('preset', 'none')
+        if preset_name in self.filter_presets:
+            filters.extend(self.filter_presets[preset_name]['filters'])
+        custom_settings = filter_settings.get('custom', {})
+        if custom_settings:
+            filters.extend(self.build_custom_filter(**custom_settings))
+        return filters
+
     def apply_filter_preset(self, 
                            input_video: str, 
                            output_video: str, 
@@ -165,14 +178,15 @@ class VideoFilterEngine:
                     '-crf', '23',
                     '-c:a', 'copy',
                     '-movflags', '+faststart',
-                    '-threads', '2',
                     '-y', output_video
                 ]
                 print(f"Applying filter chain: {filter_chain}")
                 print(f"Input: {input_video}, Output: {output_video}")
             
             print(f"Filter processing: {input_video} → {output_video}")
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=300)
+            with ffmpeg_lease() as slot:
+                cmd[-2:-2] = ['-threads', slot.threads]
+                result = run_ffmpeg(cmd, stage='filters')
             
             if result.returncode == 0:
                 print(f"Filter applied successfully: {output_video}")
@@ -182,7 +196,7 @@ class VideoFilterEngine:
                 return False
                 
         except subprocess.TimeoutExpired:
-            print("Filter application timed out")
+            print("Filter application stalled")
             return False
         except Exception as e:
             print(f"Filter application error: {e}")
@@ -213,6 +227,10 @@ def apply_video_filters(input_video: str,
 
     return filter_engine.apply_filters_to_video(input_video, output_video, filter_settings)
 
+def get_filter_chain(filter_settings: Dict) -> List[str]:
+
+    return filter_engine.get_filter_chain(filter_settings)
+
 def get_available_presets() -> Dict[str, str]:
 
     presets = filter_engine.get_filter_presets()
@@ -1,63 +1,24 @@
 import os
+import uuid
 import subprocess
-import threading
-from video_utils import get_quality_settings
+from video_utils import get_quality_settings, get_seek_args, clips_are_stream_compatible, get_fit_filter
+from ffmpeg_scheduler import lease as ffmpeg_lease, submit_in_context
+from ffmpeg_runner import run_ffmpeg, ProgressAggregator
+from clip_cache import clip_cache, clip_cache_key
+from timeline_renderer import escape_drawtext
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
-
-_active_ffmpeg_processes = 0
-_ffmpeg_lock = threading.Lock()
-
-def _get_concurrent_resource_settings():
-    
-    with _ffmpeg_lock:
-        global _active_ffmpeg_processes
-        _active_ffmpeg_processes += 1
-        active_count = _active_ffmpeg_processes
-    
-    
-    
-    import os
-    cpu_count = os.cpu_count() or 2
-    
-    if active_count >= 3:
-        
-        return {
-            'threads': '1',
-            'preset': 'ultrafast',
-            'timeout_multiplier': 2.0
-        }
-    elif active_count == 2:
-        
-        return {
-            'threads': str(min(2, cpu_count // 2)), 
-            'preset': 'veryfast',
-            'timeout_multiplier': 1.3
-        }
-    else:
-        
-        return {
-            'threads': str(min(3, cpu_count)),
-            'preset': 'fast', 
-            'timeout_multiplier': 1.0
-        }
-
-def _release_ffmpeg_process():
-    
-    with _ffmpeg_lock:
-        global _active_ffmpeg_processes
-        _active_ffmpeg_processes = max(0, _active_ffmpeg_processes - 1)
-
 def extract_clips_parallel(video_path, video_info, segments, output_dir, max_workers=2):
     """Extract multiple clips in parallel for better performance"""
     if not segments:
         return []
     
     os.makedirs(output_dir, exist_ok=True)
+    run_id = uuid.uuid4().hex[:8]
     
     def extract_single_clip(segment_data):
         i, segment = segment_data
-        clip_path = os.path.join(output_dir, f"parallel_clip_{i}.mp4")
+        clip_path = os.path.join(output_dir, f"parallel_clip_{run_id}_{i}.mp4")
         
         start = segment['start_time']
         end = segment['end_time']
@@ -73,17 +34,16 @@ def extract_clips_parallel(video_path, video_info, segments, output_dir, max_wor
     
     print(f"Extracting {len(segments)} clips in parallel (max {max_workers} workers)...")
     
-    
-    import os
     cpu_count = os.cpu_count() or 2
     max_workers = min(max_workers, cpu_count, len(segments))
     
     successful_clips = []
+    progress = ProgressAggregator('clips', [segment['end_time'] - segment['start_time'] for segment in segments])
     
     with ThreadPoolExecutor(max_workers=max_workers) as executor:
         
         future_to_index = {
-            executor.submit(extract_single_clip, (i, segment)): i 
+            submit_in_context(executor, progress.track(i, extract_single_clip), (i, segment)): i 
             for i, segment in enumerate(segments)
         }
         
@@ -107,23 +67,20 @@ def extract_clips_parallel(video_path, video_info, segments, output_dir, max_wor
 
 def extract_clip_simple(video_path, video_info, start, end, output, room_type=None):
     try:
-        
-        resource_settings = _get_concurrent_resource_settings()
-        
         width = video_info.get('width', 1920)
         height = video_info.get('height', 1080)
         fps = video_info.get('fps', 30)
         
         filters = []
 
-        filters.append("scale=1080:1920:force_original_aspect_ratio=increase,crop=1080:1920")
+        filters.append(get_fit_filter(video_path, '1080:1920'))
         if width > 1080 or height > 1920:
             print(f"Resizing from {width}x{height} to 1080x1920 for 1080p output")
 
         if room_type:
             display_text = room_type.replace('_', ' ').upper()
             text_overlay = (
-                f"drawtext=text='{display_text}':fontfile=fonts/Poppins.ttf:"
+                f"drawtext=text={escape_drawtext(display_text)}:fontfile=fonts/Poppins.ttf:"
                 f"fontsize=120:fontcolor=white:shadowcolor=black@0.8:shadowx=4:shadowy=4:"
                 f"x=(w-text_w)/2:y=h-text_h-150"
             )
@@ -133,12 +90,10 @@ def extract_clip_simple(video_path, video_info, start, end, output, room_type=No
         if filters:
             filter_arg = ['-vf', ','.join(filters)]
         
-        cmd = [
-            'ffmpeg', '-i', str(video_path),
-            '-ss', str(start), '-t', str(end - start),
+        encode_args = [
             '-c:v', 'libx264',
             '-an',  
-            '-preset', resource_settings['preset'],
+            '-preset', 'fast',
             '-crf', '23',
             '-r', str(fps),  
             '-g', str(fps),  
@@ -147,88 +102,119 @@ def extract_clip_simple(video_path, video_info, start, end, output, room_type=No
             '-maxrate', '5M',
             '-bufsize', '5M',   
             '-avoid_negative_ts', 'make_zero',
-            '-threads', resource_settings['threads'],
             '-tune', 'fastdecode',  
-            '-x264-params', 'ref=2:subme=2:me=hex:trellis=0'  
-        ] + filter_arg + ['-y', output]
+            '-x264-params', 'ref=2:subme=2:me=hex:trellis=0'
+        ]
+        
+        cache_key = clip_cache_key(video_path, kind='simple', start=start, end=end, filters=filters, encode=encode_args)
+        if clip_cache.fetch(cache_key, output):
+            print(f"Clip cache hit: {start:.1f}s-{end:.1f}s → {output}")
+            return True
+        
+        with ffmpeg_lease() as slot:
+            input_seek, output_seek = get_seek_args(video_path, start)
+            cmd = ['ffmpeg'] + input_seek + ['-i', str(video_path)] + output_seek + [
+                '-t', str(end - start)
+            ] + encode_args + ['-threads', slot.threads] + filter_arg + ['-y', output]
         
         
-        timeout_duration = int(30 * resource_settings['timeout_multiplier'])
-        print(f"Concurrent clip extraction: {start:.1f}s-{end:.1f}s → {output} ({resource_settings['threads']} threads, {timeout_duration}s timeout)")
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=timeout_duration)
+            print(f"Clip extraction: {start:.1f}s-{end:.1f}s → {output} ({slot.threads} threads)")
+            result = run_ffmpeg(cmd, expected_duration=end - start, stage='clip')
         
         if result.returncode == 0:
-            _release_ffmpeg_process()
+            clip_cache.store(cache_key, output)
             return True
         else:
             print(f"Normal clip failed: {result.stderr[-500:]}")
-            _release_ffmpeg_process()
             return False
             
     except subprocess.TimeoutExpired:
-        print(f"Normal clip timeout (concurrent load): {output}")
-        _release_ffmpeg_process()
+        print(f"Normal clip timeout: {output}")
         return False
     except Exception as e:
         print(f"Normal clip error: {e}")
-        _release_ffmpeg_process()
         return False
 
+def _hq_clip_encode_args(video_path, video_info, quality_settings, silent_mode=True, room_type=None):
+    fps = video_info.get('fps', 30)
+    encode_args = [
+        '-c:v', 'libx264',
+        '-preset', quality_settings['preset'],
+        '-crf', quality_settings['crf'],
+        '-r', str(fps),
+        '-g', str(fps),
+        '-keyint_min', str(fps),
+        '-sc_threshold', '0',
+        '-movflags', '+faststart',
+        '-avoid_negative_ts', 'make_zero'
+    ]
+    
+    if quality_settings.get('memory_optimized', False):
+        encode_args.extend([
+            '-tune', 'fastdecode',
+            '-x264-params', 'ref=2:subme=2:me=hex:trellis=0:8x8dct=0'
+        ])
+    
+    if quality_settings['maxrate'] != 'unlimited':
+        encode_args.extend(['-maxrate', quality_settings['maxrate']])
+        encode_args.extend(['-bufsize', quality_settings['bufsize']])
+    
+    # Frame every clip to the export resolution so HQ clips can be concatenated with stream copy
+    filters = [get_fit_filter(video_path, quality_settings['target_resolution'])]
+    if room_type:
+        display_text = room_type.replace('_', ' ').upper()
+        text_filter = (
+            f"drawtext=text={escape_drawtext(display_text)}:fontfile=fonts/Poppins.ttf:"
+            f"fontsize=120:fontcolor=white:shadowcolor=black@0.8:shadowx=4:shadowy=4:"
+            f"x=(w-text_w)/2:y=h-text_h-150"
+        )
+        filters.append(text_filter)
+    encode_args.extend(['-vf', ','.join(filters)])
+    
+    if silent_mode:
+        encode_args.extend(['-an'])
+    else:
+        encode_args.extend(['-c:a', 'aac', '-b:a', '192k'])
+    return encode_args
+
+def hq_clip_cache_key(video_path, video_info, start, end, speed_factor=1.0, quality_settings=None, silent_mode=True, room_type=None):
+    """The clip cache key :func:`extract_clip_hq` uses for these arguments, computed without rendering."""
+    if quality_settings is None:
+        quality_settings = get_quality_settings('high')
+    if speed_factor != 1.0:
+        return _speedup_clip_job(video_path, video_info, start, end, speed_factor, room_type)[3]
+    encode_args = _hq_clip_encode_args(video_path, video_info, quality_settings, silent_mode, room_type)
+    return clip_cache_key(video_path, kind='hq', start=start, end=end, encode=encode_args)
+
 def extract_clip_hq(video_path, video_info, start, end, output, speed_factor=1.0, quality_settings=None, silent_mode=True, room_type=None):
     if quality_settings is None:
         quality_settings = get_quality_settings('high')
         
     try:
         duration = end - start
-        width = video_info.get('width', 1920)
-        height = video_info.get('height', 1080)
         
         if speed_factor != 1.0:
             return extract_speedup_clip_fast(video_path, video_info, start, end, output, speed_factor, room_type)
         
-        cmd = [
-            'ffmpeg', '-i', str(video_path),
-            '-ss', str(start), '-t', str(duration),
-            '-c:v', 'libx264',
-            '-preset', quality_settings['preset'],
-            '-crf', quality_settings['crf'],
-            '-movflags', '+faststart',
-            '-avoid_negative_ts', 'make_zero',
-            '-threads', quality_settings.get('threads', '2')
-        ]
-        
-        if quality_settings.get('memory_optimized', False):
-            cmd.extend([
-                '-tune', 'fastdecode',
-                '-x264-params', 'ref=2:subme=2:me=hex:trellis=0:8x8dct=0'
-            ])
-        
-        if quality_settings['maxrate'] != 'unlimited':
-            cmd.extend(['-maxrate', quality_settings['maxrate']])
-            cmd.extend(['-bufsize', quality_settings['bufsize']])
-        
-        if room_type:
-            display_text = room_type.replace('_', ' ').upper()
-            text_filter = (
-                f"drawtext=text='{display_text}':fontfile=fonts/Poppins.ttf:"
-                f"fontsize=120:fontcolor=white:shadowcolor=black@0.8:shadowx=4:shadowy=4:"
-                f"x=(w-text_w)/2:y=h-text_h-150"
-            )
-            cmd.extend(['-vf', text_filter])
-        
-        if silent_mode:
-            cmd.extend(['-an'])
-        else:
-            cmd.extend(['-c:a', 'aac', '-b:a', '192k'])  
+        encode_args = _hq_clip_encode_args(video_path, video_info, quality_settings, silent_mode, room_type)
+        cache_key = clip_cache_key(video_path, kind='hq', start=start, end=end, encode=encode_args)
+        if clip_cache.fetch(cache_key, output):
+            print(f"HQ clip cache hit: {start:.1f}s-{end:.1f}s → {output}")
+            return True
         
-        cmd.extend(['-y', output])
+        with ffmpeg_lease() as slot:
+            input_seek, output_seek = get_seek_args(video_path, start)
+            cmd = ['ffmpeg'] + input_seek + ['-i', str(video_path)] + output_seek + [
+                '-t', str(duration)
+            ] + encode_args + ['-threads', slot.threads, '-y', output]
         
-        print(f"Memory-optimized HQ clip: {start:.1f}s-{end:.1f}s (bufsize: {quality_settings['bufsize']})")
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=quality_settings['timeout'])
+            print(f"Memory-optimized HQ clip: {start:.1f}s-{end:.1f}s (bufsize: {quality_settings['bufsize']})")
+            result = run_ffmpeg(cmd, expected_duration=duration, stage='clip')
         
         if result.returncode == 0:
             file_size = os.path.getsize(output) / (1024 * 1024)  
             print(f"HQ Clip created: {output} ({file_size:.1f}MB)")
+            clip_cache.store(cache_key, output)
             return True
         else:
             print(f"HQ Extraction failed: {result.stderr[-300:]}")
@@ -241,64 +227,84 @@ def extract_clip_hq(video_path, video_info, start, end, output, speed_factor=1.0
         print(f"HQ Extraction error: {e}")
         return False
 
+def _speedup_clip_job(video_path, video_info, start, end, speed_factor, room_type=None):
+    """Input seek, trim offset, encoder arguments and cache key of a sped-up clip."""
+    duration = end - start
+    width = video_info.get('width', 1920)
+    fps = video_info.get('fps', 30)
+    
+    # Seek to the preceding keyframe on the input and trim in the filter graph, before
+    # setpts rescales the timestamps, so the clip covers exactly start..end of the source
+    input_seek, output_seek = get_seek_args(video_path, start)
+    seek_offset = float(output_seek[1]) if output_seek else 0.0
+    filters = [
+        f"trim=start={seek_offset:.3f}:duration={duration:.3f}",
+        f"setpts=(PTS-STARTPTS)/{speed_factor}"
+    ]
+    
+    filters.append(get_fit_filter(video_path, '1080:1920'))
+    
+    if room_type:
+        display_text = room_type.replace('_', ' ').upper()
+        fontsize = max(36, width // 40)  
+        text_overlay = (
+            f"drawtext=text={escape_drawtext(display_text)}:fontfile=fonts/Poppins.ttf:"
+            f"fontsize={fontsize * 1.5}:fontcolor=white:shadowcolor=black@0.8:shadowx=4:shadowy=4:"
+            f"x=(w-text_w)/2:y=h-text_h-275"
+        )
+        filters.append(text_overlay)
+    
+    video_filter = ",".join(filters)
+    
+    encode_args = [
+        '-filter:v', video_filter,
+        '-an',  
+        '-c:v', 'libx264',
+        '-preset', 'veryfast',
+        '-crf', '23',  
+        '-r', str(fps),  
+        '-g', str(fps),  
+        '-keyint_min', str(fps),  
+        '-sc_threshold', '0',  
+        '-maxrate', '6M',  
+        '-bufsize', '6M',  
+        '-tune', 'fastdecode',  
+        '-x264-params', 'ref=2:subme=2:me=hex:trellis=0',  
+        '-movflags', '+faststart'
+    ]
+    
+    cache_key = clip_cache_key(video_path, kind='speedup', start=start, end=end, speed_factor=speed_factor,
+                               seek=input_seek, encode=encode_args)
+    return input_seek, seek_offset, encode_args, cache_key
+
 def extract_speedup_clip_fast(video_path, video_info, start, end, output, speed_factor=1.0, room_type=None):
     try:
         duration = end - start
         width = video_info.get('width', 1920)
         height = video_info.get('height', 1080)
-        fps = video_info.get('fps', 30)
-        
-        filters = [f"setpts=PTS/{speed_factor}"]
-        
-        filters.append("scale=1080:1920:force_original_aspect_ratio=increase,crop=1080:1920")
         if width > 1080 or height > 1920:
             print(f"Resizing from {width}x{height} to 1080x1920 for 1080p output")
         
-        if room_type:
-            display_text = room_type.replace('_', ' ').upper()
-            fontsize = max(36, width // 40)  
-            text_overlay = (
-                f"drawtext=text='{display_text}':fontfile=fonts/Poppins.ttf:"
-                f"fontsize={fontsize * 1.5}:fontcolor=white:shadowcolor=black@0.8:shadowx=4:shadowy=4:"
-                f"x=(w-text_w)/2:y=h-text_h-275"
-            )
-            filters.append(text_overlay)
-        
-        video_filter = ",".join(filters)
-        
-        cmd = [
-            'ffmpeg', '-i', str(video_path),
-            '-ss', str(start), '-t', str(duration),
-            '-filter:v', video_filter,
-            '-an',  
-            '-c:v', 'libx264',
-            '-preset', 'veryfast',
-            '-crf', '23',  
-            '-r', str(fps),  
-            '-g', str(fps),  
-            '-keyint_min', str(fps),  
-            '-sc_threshold', '0',  
-            '-maxrate', '6M',  
-            '-bufsize', '6M',  
-            '-threads', '2',  
-            '-tune', 'fastdecode',  
-            '-x264-params', 'ref=2:subme=2:me=hex:trellis=0',  
-            '-movflags', '+faststart',
-            '-y', output
-        ]
+        input_seek, seek_offset, encode_args, cache_key = _speedup_clip_job(
+            video_path, video_info, start, end, speed_factor, room_type
+        )
+        if clip_cache.fetch(cache_key, output):
+            print(f"Speedup clip cache hit: {start:.1f}s-{end:.1f}s at {speed_factor}x → {output}")
+            return True
         
-        base_timeout = min(90, int(duration * 2.5))
-        if width > 2560:
-            timeout_duration = base_timeout * 2
-        else:
-            timeout_duration = base_timeout
+        with ffmpeg_lease() as slot:
+            cmd = ['ffmpeg'] + input_seek + [
+                '-t', f'{seek_offset + duration:.3f}',
+                '-i', str(video_path)
+            ] + encode_args + ['-threads', slot.threads, '-y', output]
         
-        print(f"Memory-optimized speedup processing: {timeout_duration}s timeout")
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=timeout_duration)
+            print(f"Memory-optimized speedup processing: {duration:.1f}s at {speed_factor}x")
+            result = run_ffmpeg(cmd, expected_duration=duration / speed_factor, stage='clip')
         
         if result.returncode == 0:
             file_size = os.path.getsize(output) / (1024 * 1024)
             print(f"Fast speedup clip: {output} ({file_size:.1f}MB)")
+            clip_cache.store(cache_key, output)
             return True
         else:
             print(f"Fast speedup failed: {result.stderr[-200:]}")
@@ -315,13 +321,9 @@ def extract_speedup_clip_fast(video_path, video_info, start, end, output, speed_
 
 def combine_clips(clips, output, silent_mode=True, project_temp_dir=None):
     try:
-        resource_settings = _get_concurrent_resource_settings()
-        
-        
         for clip in clips:
             if not os.path.exists(clip):
                 print(f"Missing clip: {clip}")
-                _release_ffmpeg_process()
                 return False
         
         
@@ -336,47 +338,61 @@ def combine_clips(clips, output, silent_mode=True, project_temp_dir=None):
                 for clip in clips:
                     f.write(f"file '{os.path.abspath(clip)}'\n")
             
+            with ffmpeg_lease() as slot:
+                if clips_are_stream_compatible(clips):
+                    copy_cmd = [
+                        'ffmpeg', '-f', 'concat', '-safe', '0',
+                        '-i', concat_file,
+                        '-c', 'copy',
+                        '-movflags', '+faststart'
+                    ]
+                    if silent_mode:
+                        copy_cmd.append('-an')
+                    copy_cmd.extend(['-y', output])
+                
+                    print(f"Clips are stream-compatible, concatenating {len(clips)} clips with stream copy → {output}")
+                    copy_result = run_ffmpeg(copy_cmd, stage='combine')
+                
+                    if copy_result.returncode == 0 and os.path.exists(output) and os.path.getsize(output) > 1000:
+                        print(f"Tour created: {output}")
+                        return True
+                    print(f"Stream copy concat failed, falling back to re-encode: {copy_result.stderr[-300:]}")
             
-            cmd = [
-                'ffmpeg', '-f', 'concat', '-safe', '0', 
-                '-i', concat_file,
-                '-c:v', 'libx264',
-                '-preset', 'veryfast',  
-                '-crf', '20',  
-                '-r', '30',  
-                '-g', '30',  
-                '-keyint_min', '30',  
-                '-sc_threshold', '0',  
-                '-movflags', '+faststart',
-                '-threads', resource_settings['threads'],
-                '-tune', 'fastdecode',
-                '-x264-params', 'ref=1:subme=1:me=hex:trellis=0',  
-                '-maxrate', '15M',  
-                '-bufsize', '15M',
-                '-y', output
-            ]
-            
-            if silent_mode:
-                cmd.extend(['-an'])
-                print(f"Combining {len(clips)} clips into silent video → {output}")
-            else:
-                cmd.extend(['-c:a', 'aac']) 
-                print(f"Combining {len(clips)} clips → {output}")
+                cmd = [
+                    'ffmpeg', '-f', 'concat', '-safe', '0', 
+                    '-i', concat_file,
+                    '-c:v', 'libx264',
+                    '-preset', 'veryfast',  
+                    '-crf', '20',  
+                    '-r', '30',  
+                    '-g', '30',  
+                    '-keyint_min', '30',  
+                    '-sc_threshold', '0',  
+                    '-movflags', '+faststart',
+                    '-threads', slot.threads,
+                    '-tune', 'fastdecode',
+                    '-x264-params', 'ref=1:subme=1:me=hex:trellis=0',  
+                    '-maxrate', '15M',  
+                    '-bufsize', '15M',
+                    '-y', output
+                ]
             
+                if silent_mode:
+                    cmd.extend(['-an'])
+                    print(f"Combining {len(clips)} clips into silent video → {output}")
+                else:
+                    cmd.extend(['-c:a', 'aac']) 
+                    print(f"Combining {len(clips)} clips → {output}")
             
-            base_timeout = 180 if len(clips) > 3 else 120
-            timeout_duration = int(base_timeout * resource_settings['timeout_multiplier'])
             
-            print(f"Optimized concurrent processing: {resource_settings['threads']} threads, {resource_settings['preset']} preset, {timeout_duration}s timeout")
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=timeout_duration)  
+                print(f"Combining with {slot.threads} threads, veryfast preset")
+                result = run_ffmpeg(cmd, stage='combine')
             
             if result.returncode == 0:
                 print(f"Tour created: {output}")
-                _release_ffmpeg_process()
                 return True
             else:
                 print(f"FFmpeg combine error: {result.stderr}")
-                _release_ffmpeg_process()
                 return False
                 
         finally:
@@ -388,7 +404,7 @@ def combine_clips(clips, output, silent_mode=True, project_temp_dir=None):
                     print(f"Warning: Could not remove concat file: {e}")
         
     except subprocess.TimeoutExpired:
-        print(f"FFmpeg timeout during combine (concurrent load)")
+        print(f"FFmpeg timeout during combine")
         
         if os.path.exists(output):
             try:
@@ -396,21 +412,15 @@ def combine_clips(clips, output, silent_mode=True, project_temp_dir=None):
                 print(f"Removed partial output file: {output}")
             except OSError as e:
                 print(f"Could not remove partial file: {e}")
-        _release_ffmpeg_process()
         return False
     except Exception as e:
         print(f"Combine error: {e}")
-        _release_ffmpeg_process()
         return False
 
 def combine_clips_hq(clips, output, quality_settings, project_temp_dir=None):
     try:
-        
-        resource_settings = _get_concurrent_resource_settings()
-        
         if not clips:
             print("No clips to combine")
-            _release_ffmpeg_process()
             return False
         
         valid_clips = []
@@ -422,7 +432,6 @@ def combine_clips_hq(clips, output, quality_settings, project_temp_dir=None):
         
         if not valid_clips:
             print("No valid clips to combine")
-            _release_ffmpeg_process()
             return False
         
         
@@ -437,38 +446,53 @@ def combine_clips_hq(clips, output, quality_settings, project_temp_dir=None):
                 f.write(f"file '{os.path.abspath(clip).replace(os.sep, '/')}'\n")
         
         
-        concurrent_preset = resource_settings['preset'] if resource_settings['preset'] != 'ultrafast' else 'veryfast'
-        cmd = [
-            'ffmpeg', '-f', 'concat', '-safe', '0',
-            '-i', concat_file,
-            '-c:v', 'libx264',
-            '-preset', concurrent_preset,
-            '-crf', '23',
-            '-threads', resource_settings['threads'],  
-            '-movflags', '+faststart',
-            '-avoid_negative_ts', 'make_zero',
-            '-an',  
-            '-y', output
-        ]
-        
-        if quality_settings.get('memory_optimized', False):
-            cmd.extend([
-                '-tune', 'fastdecode',
-                '-x264-params', 'ref=2:subme=2:me=hex:trellis=0:8x8dct=0'
-            ])
+        with ffmpeg_lease() as slot:
+            if clips_are_stream_compatible(valid_clips):
+                copy_cmd = [
+                    'ffmpeg', '-f', 'concat', '-safe', '0',
+                    '-i', concat_file,
+                    '-c', 'copy',
+                    '-movflags', '+faststart',
+                    '-an',
+                    '-y', output
+                ]
+                print(f"HQ clips are stream-compatible, concatenating {len(valid_clips)} clips with stream copy → {output}")
+                copy_result = run_ffmpeg(copy_cmd, stage='combine')
+                
+                if copy_result.returncode == 0 and os.path.exists(output) and os.path.getsize(output) > 1000:
+                    os.remove(concat_file)
+                    file_size = os.path.getsize(output) / (1024 * 1024)
+                    print(f"HQ tour created: {output} ({file_size:.1f}MB)")
+                    return True
+                print(f"Stream copy concat failed, falling back to re-encode: {copy_result.stderr[-300:]}")
+            
+            cmd = [
+                'ffmpeg', '-f', 'concat', '-safe', '0',
+                '-i', concat_file,
+                '-c:v', 'libx264',
+                '-preset', 'fast',
+                '-crf', '23',
+                '-threads', slot.threads,  
+                '-movflags', '+faststart',
+                '-avoid_negative_ts', 'make_zero',
+                '-an'
+            ]
         
-        if quality_settings['maxrate'] != 'unlimited':
-            cmd.extend(['-maxrate', quality_settings['maxrate']])
-            cmd.extend(['-bufsize', quality_settings['bufsize']])
+            if quality_settings.get('memory_optimized', False):
+                cmd.extend([
+                    '-tune', 'fastdecode',
+                    '-x264-params', 'ref=2:subme=2:me=hex:trellis=0:8x8dct=0'
+                ])
         
+            if quality_settings['maxrate'] != 'unlimited':
+                cmd.extend(['-maxrate', quality_settings['maxrate']])
+                cmd.extend(['-bufsize', quality_settings['bufsize']])
         
-        base_timeout = quality_settings['timeout']
-        timeout_duration = int(base_timeout * resource_settings['timeout_multiplier'])
+            cmd.extend(['-y', output])
         
-        print(f"Concurrent HQ processing: {resource_settings['threads']} threads, {concurrent_preset} preset, {timeout_duration}s timeout")
-        print(f"Memory-optimized HQ combining {len(valid_clips)} clips with {concurrent_preset} preset (bufsize: {quality_settings['bufsize']})...")
+            print(f"Memory-optimized HQ combining {len(valid_clips)} clips: {slot.threads} threads, fast preset (bufsize: {quality_settings['bufsize']})...")
         
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=timeout_duration)
+            result = run_ffmpeg(cmd, stage='combine')
         
         if os.path.exists(concat_file):
             os.remove(concat_file)
@@ -476,15 +500,13 @@ def combine_clips_hq(clips, output, quality_settings, project_temp_dir=None):
         if result.returncode == 0:
             file_size = os.path.getsize(output) / (1024 * 1024)
             print(f"Memory-optimized HQ tour created: {output} ({file_size:.1f}MB)")
-            _release_ffmpeg_process()
             return True
         else:
             print(f"HQ combine failed: {result.stderr[-500:]}")
-            _release_ffmpeg_process()
             return False
 
     except subprocess.TimeoutExpired:
-        print(f"HQ combine timeout (concurrent load)")
+        print(f"HQ combine timeout")
         
         if os.path.exists(output):
             try:
@@ -492,11 +514,9 @@ def combine_clips_hq(clips, output, quality_settings, project_temp_dir=None):
                 print(f"Removed partial HQ output file: {output}")
             except OSError as e:
                 print(f"Could not remove partial HQ file: {e}")
-        _release_ffmpeg_process()
         return False
     except Exception as e:
         print(f"HQ combine error: {e}")
-        _release_ffmpeg_process()
         return False
 
  
\ No newline at end of file
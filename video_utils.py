@@ -1,7 +1,16 @@
 import cv2
 import os
+import json
+import bisect
+import subprocess
+import threading
 from pathlib import Path
 
+_keyframe_index_cache = {}
+_keyframe_index_lock = threading.Lock()
+_geometry_cache = {}
+_geometry_lock = threading.Lock()
+
 def get_video_info(video_path):
     try:
         cap = cv2.VideoCapture(str(video_path))
@@ -70,4 +79,252 @@ def capture_frame(video_path, timestamp, output_path):
         return True
     except Exception as exc:
         print(f"Frame capture error: {exc}")
-        return False 
\ No newline at end of file
+        return False
+
+def get_keyframe_index_path(video_path):
+    return f"{video_path}.keyframes.json"
+
+def build_keyframe_index(video_path, timeout=120):
+    """Scan the video packets once with ffprobe and store the keyframe timestamps next to the video."""
+    cmd = [
+        'ffprobe', '-v', 'error',
+        '-select_streams', 'v:0',
+        '-show_entries', 'packet=pts_time,flags',
+        '-of', 'csv=p=0',
+        str(video_path)
+    ]
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True, timeout=timeout)
+    except (subprocess.TimeoutExpired, FileNotFoundError) as e:
+        print(f"Keyframe index error for {video_path}: {e}")
+        return None
+
+    if result.returncode != 0:
+        print(f"Keyframe index failed for {video_path}: {result.stderr[-300:]}")
+        return None
+
+    keyframes = []
+    for line in result.stdout.splitlines():
+        fields = line.strip().split(',')
+        if len(fields) < 2 or 'K' not in fields[1]:
+            continue
+        try:
+            keyframes.append(round(float(fields[0]), 6))
+        except ValueError:
+            continue
+    keyframes = sorted(set(keyframes))
+
+    if not keyframes:
+        print(f"No keyframes found in {video_path}")
+        return None
+
+    index_path = get_keyframe_index_path(video_path)
+    try:
+        with open(index_path, 'w') as f:
+            json.dump({'keyframes': keyframes}, f)
+    except OSError as e:
+        print(f"Could not save keyframe index: {e}")
+
+    with _keyframe_index_lock:
+        _keyframe_index_cache[str(video_path)] = (os.path.getmtime(video_path), keyframes)
+
+    print(f"Keyframe index built: {len(keyframes)} keyframes → {index_path}")
+    return keyframes
+
+def load_keyframe_index(video_path):
+    video_path = str(video_path)
+    index_path = get_keyframe_index_path(video_path)
+    try:
+        video_mtime = os.path.getmtime(video_path)
+    except OSError:
+        return None
+
+    with _keyframe_index_lock:
+        cached = _keyframe_index_cache.get(video_path)
+        if cached and cached[0] == video_mtime:
+            return cached[1]
+
+    if not os.path.exists(index_path) or os.path.getmtime(index_path) < video_mtime:
+        return None
+
+    try:
+        with open(index_path, 'r') as f:
+            keyframes = json.load(f).get('keyframes') or None
+    except (OSError, ValueError) as e:
+        print(f"Could not load keyframe index {index_path}: {e}")
+        return None
+
+    with _keyframe_index_lock:
+        _keyframe_index_cache[video_path] = (video_mtime, keyframes)
+    return keyframes
+
+def find_seek_point(keyframes, timestamp):
+    if not keyframes:
+        return None
+    position = bisect.bisect_right(keyframes, timestamp + 1e-6)
+    if position == 0:
+        return 0.0
+    return keyframes[position - 1]
+
+def get_seek_args(video_path, start):
+    """Return (input_args, output_args) that seek to the keyframe before ``start`` and then trim exactly."""
+    keyframe = find_seek_point(load_keyframe_index(video_path), start)
+    if keyframe is None:
+        return ['-ss', f'{start:.3f}'], []
+
+    offset = start - keyframe
+    output_args = ['-ss', f'{offset:.3f}'] if offset > 0.0005 else []
+    return ['-ss', f'{keyframe:.3f}'], output_args
+
+STREAM_COPY_FIELDS = (
+    'codec_type', 'codec_name', 'profile', 'level', 'width', 'height', 'pix_fmt',
+    'sample_aspect_ratio', 'field_order', 'time_base', 'r_frame_rate',
+    'sample_rate', 'channels', 'extradata_hash'
+)
+
+def probe_stream_params(video_path, timeout=30):
+    """Return the per-stream parameters that must match for a ``-c copy`` concat, or None."""
+    cmd = [
+        'ffprobe', '-v', 'error',
+        '-show_data_hash', 'SHA256',
+        '-show_entries', 'stream=' + ','.join(STREAM_COPY_FIELDS),
+        '-of', 'json',
+        str(video_path)
+    ]
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True, timeout=timeout)
+    except (subprocess.TimeoutExpired, FileNotFoundError) as e:
+        print(f"Stream probe error for {video_path}: {e}")
+        return None
+
+    if result.returncode != 0:
+        print(f"Stream probe failed for {video_path}: {result.stderr[-300:]}")
+        return None
+
+    try:
+        streams = json.loads(result.stdout).get('streams', [])
+    except ValueError:
+        return None
+
+    return [tuple(str(stream.get(field, '')) for field in STREAM_COPY_FIELDS) for stream in streams]
+
+def clips_are_stream_compatible(clips):
+    """True when every clip has the same codec, profile, geometry, timebase, frame rate and SPS/PPS."""
+    if not clips:
+        return False
+
+    reference = probe_stream_params(clips[0])
+    if not reference:
+        return False
+
+    for clip in clips[1:]:
+        params = probe_stream_params(clip)
+        if params != reference:
+            print(f"Stream parameters differ for {clip}; stream copy not possible")
+            return False
+    return True
+
+def _parse_ratio(value, default=1.0):
+    try:
+        numerator, denominator = str(value).replace('/', ':').split(':')
+        numerator, denominator = float(numerator), float(denominator)
+        if numerator > 0 and denominator > 0:
+            return numerator / denominator
+    except ValueError:
+        pass
+    return default
+
+def probe_video_geometry(video_path, timeout=30):
+    """Probe the coded size, sample aspect ratio and rotation of the first video stream.
+
+    Returns ``{'width', 'height', 'sar', 'rotation'}`` or None. Results are cached per file mtime.
+    """
+    video_path = str(video_path)
+    try:
+        video_mtime = os.path.getmtime(video_path)
+    except OSError:
+        return None
+
+    with _geometry_lock:
+        cached = _geometry_cache.get(video_path)
+        if cached and cached[0] == video_mtime:
+            return cached[1]
+
+    cmd = [
+        'ffprobe', '-v', 'error',
+        '-select_streams', 'v:0',
+        '-show_entries', 'stream=width,height,sample_aspect_ratio:stream_tags=rotate:stream_side_data=rotation',
+        '-of', 'json',
+        video_path
+    ]
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True, timeout=timeout)
+        streams = json.loads(result.stdout).get('streams', []) if result.returncode == 0 else []
+    except (subprocess.TimeoutExpired, FileNotFoundError, ValueError) as e:
+        print(f"Geometry probe error for {video_path}: {e}")
+        return None
+
+    if not streams or not streams[0].get('width') or not streams[0].get('height'):
+        return None
+
+    stream = streams[0]
+    rotation = 0
+    for side_data in stream.get('side_data_list', []):
+        if 'rotation' in side_data:
+            rotation = int(float(side_data['rotation']))
+    if not rotation and stream.get('tags', {}).get('rotate'):
+        rotation = int(float(stream['tags']['rotate']))
+
+    geometry = {
+        'width': int(stream['width']),
+        'height': int(stream['height']),
+        'sar': _parse_ratio(stream.get('sample_aspect_ratio')),
+        'rotation': rotation % 360
+    }
+    with _geometry_lock:
+        _geometry_cache[video_path] = (video_mtime, geometry)
+    return geometry
+
+def _even(value):
+    return max(2, int(value) // 2 * 2)
+
+def plan_fit_filter(geometry, target_resolution='1080:1920'):
+    """Fill ``target_resolution`` by cropping the source window first and scaling only that window.
+
+    Scaling the full frame up and then cropping makes the scaler process every pixel that is
+    cropped away; cropping first keeps the scaler at output size. Without a probed geometry the
+    same crop is expressed in terms of the input size so it still runs before the scale.
+    """
+    target_width, target_height = (int(value) for value in target_resolution.split(':'))
+    target_aspect = target_width / target_height
+
+    if not geometry:
+        return (
+            f"crop=w='min(iw,ih*{target_aspect:.6f}/sar)':h='min(ih,iw*sar/{target_aspect:.6f})',"
+            f"scale={target_width}:{target_height},setsar=1"
+        )
+
+    width, height, sar = geometry['width'], geometry['height'], geometry.get('sar') or 1.0
+    # ffmpeg autorotates before the filter graph, which swaps the axes and inverts the SAR
+    if geometry.get('rotation') in (90, 270):
+        width, height, sar = height, width, 1.0 / sar
+
+    if width * sar / height > target_aspect:
+        crop_width, crop_height = _even(height * target_aspect / sar), _even(height)
+    else:
+        crop_width, crop_height = _even(width), _even(width * sar / target_aspect)
+    crop_width, crop_height = min(crop_width, width), min(crop_height, height)
+
+    filters = []
+    if (crop_width, crop_height) != (width, height):
+        x = (width - crop_width) // 4 * 2
+        y = (height - crop_height) // 4 * 2
+        filters.append(f"crop={crop_width}:{crop_height}:{x}:{y}")
+    if (crop_width, crop_height) != (target_width, target_height) or abs(sar - 1.0) > 1e-3:
+        filters.append(f"scale={target_width}:{target_height}")
+    filters.append('setsar=1')
+    return ','.join(filters)
+
+def get_fit_filter(video_path, target_resolution='1080:1920'):
+    return plan_fit_filter(probe_video_geometry(video_path), target_resolution)
+